@@ -0,0 +1,232 @@
+""" Async read path of the JSON API on aiosqlite, served as a small ASGI app.
+    It answers the same /api routes as the Flask app for the read-heavy
+    Controller operations and logs users in with the Flask session cookie.
+
+    >> python aio.py --db-url sqlite:///todo.db --port 8001 """
+
+import os
+import json
+import asyncio
+import argparse
+from datetime import datetime
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+import aiosqlite
+from flask import Flask
+from sqlalchemy.engine.url import make_url
+
+import constants
+from pagination import paginate, decode_cursor
+
+
+# Format SQLAlchemy stores DateTime columns in on SQLite
+SQLITE_DATETIME = "%Y-%m-%d %H:%M:%S.%f"
+
+ASSIGNED_TASKS = """
+    SELECT tasks_assignment.*, category_name, status_name, priority_name, username, group_name
+    FROM tasks_assignment
+    JOIN categories ON categories.category_id = tasks_assignment.category_id
+    JOIN status ON status.status_id = tasks_assignment.status_id
+    JOIN priorities ON priorities.priority_id = tasks_assignment.priority_id
+    JOIN users ON users.user_id = tasks_assignment.{user}
+    JOIN groups ON groups.group_id = tasks_assignment.group_id
+    WHERE tasks_assignment.{filter} = ?
+    ORDER BY tasks_assignment.task_date"""
+
+
+class AsyncController(object):
+    """ AsyncController runs the read-heavy Controller operations on a pool
+        of aiosqlite connections. Every connection runs its queries on its
+        own thread, so the event loop is never blocked by SQLite I/O.
+        Rows are returned as dicts shaped like the JSON API. """
+
+    def __init__(self, DB_URL, profile="default", pool_size=4):
+        self.path = make_url(DB_URL).database
+        self.pragmas = constants.SQLITE_PROFILES[profile]
+        self.pool_size = pool_size
+        self.pool = None
+
+    async def connect(self):
+        self.pool = asyncio.Queue()
+        for _ in range(self.pool_size):
+            connection = await aiosqlite.connect(self.path)
+            connection.row_factory = aiosqlite.Row
+            for name, value in self.pragmas.items():
+                await connection.execute(f"PRAGMA {name} = {value}")
+            self.pool.put_nowait(connection)
+
+    async def close(self):
+        for _ in range(self.pool_size):
+            connection = await self.pool.get()
+            await connection.close()
+
+    async def fetch(self, sql, *params):
+        connection = await self.pool.get()
+        try:
+            async with connection.execute(sql, params) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+        finally:
+            self.pool.put_nowait(connection)
+
+    ### METHODS FOR TASK
+    async def get_tasks(self, user_id, after=None, limit=constants.PAGE_SIZE):
+        """ A page of tasks of a user. :after: is the cursor of the previous page. """
+
+        after = decode_cursor(after, int)
+        tasks = await self.fetch("""
+            SELECT tasks.*, category_name, status_name, priority_name FROM tasks
+            JOIN categories ON categories.category_id = tasks.category_id
+            JOIN status ON status.status_id = tasks.status_id
+            JOIN priorities ON priorities.priority_id = tasks.priority_id
+            WHERE tasks.user_id = ? AND tasks.deleted_at IS NULL AND tasks.task_id > ?
+            ORDER BY tasks.task_id LIMIT ?""", user_id, after[0] if after else 0, limit + 1)
+        return paginate(tasks, limit, lambda row: (row["task_id"],))
+
+    ### METHODS FOR LOGS
+    async def get_all_activities(self, user_id, after=None, limit=constants.PAGE_SIZE):
+        """ A page of the activities of a user, newest first """
+
+        after = decode_cursor(after, datetime.fromisoformat, int)
+        keyset = "AND (log_date, log_id) < (?, ?)" if after else ""
+        params = (after[0].strftime(SQLITE_DATETIME), after[1]) if after else ()
+        activities = await self.fetch(f"""
+            SELECT log_id, log_date, activity_name, tasks.task_id, task_title FROM activities_log
+            JOIN available_activities ON available_activities.activity_id = activities_log.activity_id
+            JOIN tasks ON tasks.task_id = activities_log.task_id
+            WHERE activities_log.user_id = ? AND tasks.deleted_at IS NULL {keyset}
+            ORDER BY log_date DESC, log_id DESC LIMIT ?""", user_id, *params, limit + 1)
+        for activity in activities:
+            activity["log_date"] = datetime.strptime(activity["log_date"], SQLITE_DATETIME)
+        page = paginate(activities, limit, lambda row: (row["log_date"], row["log_id"]))
+        for activity in page.items:
+            activity["log_date"] = activity["log_date"].isoformat()
+        return page
+
+    ### METHODS FOR GROUPS
+    async def get_request(self, receiver_id):
+        requests = await self.fetch("""
+            SELECT request.group_id, group_name, users.user_id AS sender_id, username AS sender_name
+            FROM request
+            JOIN groups ON groups.group_id = request.group_id
+            JOIN users ON users.user_id = request.sender_id
+            WHERE request.receiver_id = ?""", receiver_id)
+        return requests
+
+    ### METHODS FOR ASSIGNING TASK TO OTHERS
+    async def get_assigned_tasks(self, user_id):
+        """ Tasks assigned to a user, with the assigner as username """
+
+        assignedTasks = await self.fetch(ASSIGNED_TASKS.format(user="assigner_id", filter="assignee_id"), user_id)
+        return assignedTasks
+
+    async def track_assigned_task(self, user_id):
+        """ Tasks a user assigned, with the assignee as username """
+
+        assignedTasks = await self.fetch(ASSIGNED_TASKS.format(user="assignee_id", filter="assigner_id"), user_id)
+        return assignedTasks
+
+
+class AsyncApp(object):
+    """ Minimal ASGI app for the async read path.
+        Users are logged in by the session cookie the Flask app signed. """
+
+    def __init__(self, controller, secret_key=constants.SECRET_KEY):
+        self.controller = controller
+        sessions = Flask("Todo App")
+        sessions.config["SECRET_KEY"] = secret_key
+        self.cookie_name = sessions.config["SESSION_COOKIE_NAME"]
+        self.max_age = int(sessions.permanent_session_lifetime.total_seconds())
+        self.serializer = sessions.session_interface.get_signing_serializer(sessions)
+        self.routes = {
+            "/api/tasks": self.tasks,
+            "/api/requests": self.requests,
+            "/api/assigned-tasks": self.assigned_tasks,
+            "/api/activity": self.activity
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        handler = self.routes.get(scope["path"])
+        if handler is None or scope["method"] != "GET":
+            return await self.respond(send, 404, {"error": "Not found"})
+        user_id = self.get_user_id(scope)
+        if user_id is None:
+            return await self.respond(send, 401, {"error": "Not logged in"})
+        args = {key: values[-1] for key, values in parse_qs(scope["query_string"].decode()).items()}
+        await self.respond(send, 200, await handler(user_id, args))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.controller.connect()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.controller.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def get_user_id(self, scope):
+        headers = dict(scope["headers"])
+        cookie = SimpleCookie(headers.get(b"cookie", b"").decode("latin-1")).get(self.cookie_name)
+        if cookie is None:
+            return None
+        try:
+            return self.serializer.loads(cookie.value, max_age=self.max_age).get("user_id")
+        except Exception:
+            return None
+
+    async def respond(self, send, status, data):
+        # Same bytes as Flask's jsonify, so both servers answer alike
+        body = (json.dumps(data, sort_keys=True, separators=(",", ":")) + "\n").encode()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    def limit(self, args):
+        try:
+            limit = int(args.get("limit", constants.PAGE_SIZE))
+        except ValueError:
+            limit = constants.PAGE_SIZE
+        return min(max(limit, 1), constants.API_MAX_LIMIT)
+
+    ### ROUTES, SAME RESPONSES AS THE FLASK /api ROUTES WITHOUT THE ETAGS
+    async def tasks(self, user_id, args):
+        page = await self.controller.get_tasks(user_id, args.get("after"), self.limit(args))
+        return {"tasks": page.items, "next_cursor": page.next_cursor}
+
+    async def requests(self, user_id, args):
+        return {"requests": await self.controller.get_request(user_id)}
+
+    async def assigned_tasks(self, user_id, args):
+        return {"assigned_to_me": await self.controller.get_assigned_tasks(user_id),
+                "assigned_by_me": await self.controller.track_assigned_task(user_id)}
+
+    async def activity(self, user_id, args):
+        page = await self.controller.get_all_activities(user_id, args.get("after"), self.limit(args))
+        return {"activities": page.items, "next_cursor": page.next_cursor}
+
+
+def create_asgi_app(DB_URL, profile="default", pool_size=4):
+    return AsyncApp(AsyncController(DB_URL, profile, pool_size))
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Async read path of the JSON API")
+    parser.add_argument("--db-url", default=os.environ.get("TODO_DB_URL", constants.DB_URL))
+    parser.add_argument("--db-profile", default=os.environ.get("TODO_DB_PROFILE", constants.DB_PROFILE),
+                        choices=constants.SQLITE_PROFILES)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+
+    uvicorn.run(create_asgi_app(args.db_url, args.db_profile, args.pool_size), host="0.0.0.0", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
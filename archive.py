@@ -0,0 +1,41 @@
+import json
+import zlib
+from datetime import datetime, timedelta
+
+import constants
+from jobs import BatchJob
+
+
+def pack_logs(rows):
+    """ Compress archived activity logs, given as [log_id, activity_id, task_id, log_date] lists """
+
+    return zlib.compress(json.dumps(rows, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def unpack_logs(data):
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+class ActivityArchiver(BatchJob):
+    """ ActivityArchiver moves activity logs older than retention_days out of
+        the activities_log table into compressed segments per user and month,
+        every interval seconds, batch_size logs per transaction. """
+
+    name = "activity-archiver"
+    message = "Archived %d activity logs"
+
+    def __init__(self, controller, retention_days=constants.ACTIVITY_RETENTION_DAYS, 
+                 interval=constants.ARCHIVE_INTERVAL, batch_size=constants.ARCHIVE_BATCH_SIZE, 
+                 pause=constants.ARCHIVE_PAUSE):
+        self.controller = controller
+        self.retention = timedelta(days=retention_days)
+        self.before = None
+        super().__init__(interval, batch_size, pause)
+
+    def run_batches(self):
+        # Every batch of a run archives up to the same date
+        self.before = datetime.now() - self.retention
+        return super().run_batches()
+
+    def batch(self):
+        return self.controller.archive_activities(self.before, self.batch_size)
@@ -0,0 +1,198 @@
+""" Benchmark the routes of the app and the Customer methods on a synthetic DB.
+    Routes are called through the Flask test client as random logged in users,
+    Customer methods directly with a session. Reports p50/p95/p99 latency and
+    queries per call, and writes the results as JSON. With --baseline, the
+    p50/p95 changes against an earlier run are shown as well.
+
+    >> python bench.py --users 200 --tasks 100 --output after.json --baseline before.json """
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import date, datetime
+
+from sqlalchemy import event
+
+import constants
+from core import Controller
+from server import create_app
+from generate import generate, BASE_DATE
+
+
+# name, method, path, form; {placeholders} are filled in for every call
+ROUTES = [
+    ("GET /", "GET", "/", None),
+    ("GET /search/c", "GET", "/search/c/{category_id}", None),
+    ("GET /search/s", "GET", "/search/s/{status_id}", None),
+    ("GET /search/p", "GET", "/search/p/{priority_id}", None),
+    ("GET /search", "GET", "/search?parameter={word}", None),
+    ("GET /allactivity", "GET", "/allactivity", None),
+    ("GET /files", "GET", "/files", None),
+    ("GET /groups", "GET", "/groups", None),
+    ("GET /track-assigned-task", "GET", "/track-assigned-task", None),
+    ("GET /api/tasks", "GET", "/api/tasks", None),
+    ("GET /api/activity", "GET", "/api/activity", None),
+    ("GET /api/groups", "GET", "/api/groups", None),
+    ("POST /add-task", "POST", "/add-task", {"task_title": "bench {word}", "task_desc": "benchmark",
+        "task_date": "{today}", "category_id": "{category_id}", "status_id": "{status_id}",
+        "priority_id": "{priority_id}"}),
+]
+
+# name, f(controller, session, user_id, params)
+METHODS = [
+    ("get_tasks", lambda fos, session, user_id, params:
+        fos.customer.get_tasks(session, user_id, fos.get_lookups(), None, constants.PAGE_SIZE + 1)),
+    ("get_dashboard", lambda fos, session, user_id, params:
+        fos.get_dashboard(user_id)),
+    ("search_by", lambda fos, session, user_id, params:
+        fos.customer.search_by(session, user_id, params["word"], fos.fts_enabled, None, constants.PAGE_SIZE + 1)),
+    ("get_all_activities", lambda fos, session, user_id, params:
+        fos.customer.get_all_activities(session, user_id, None, constants.PAGE_SIZE + 1)),
+    ("get_group_members", lambda fos, session, user_id, params:
+        fos.customer.get_group_members(session, user_id)),
+    ("get_assigned_tasks", lambda fos, session, user_id, params:
+        fos.customer.get_assigned_tasks(session, user_id, fos.get_lookups())),
+    ("get_request", lambda fos, session, user_id, params:
+        fos.customer.get_request(session, user_id)),
+]
+
+
+def percentile(timings, p):
+    return timings[min(int(len(timings) * p), len(timings) - 1)]
+
+
+def summarize(timings, queries):
+    timings = sorted(timings)
+    return {"calls": len(timings), "mean_ms": sum(timings) / len(timings) * 1000,
+            "p50_ms": percentile(timings, 0.5) * 1000, "p95_ms": percentile(timings, 0.95) * 1000,
+            "p99_ms": percentile(timings, 0.99) * 1000, "queries": queries / len(timings)}
+
+
+def random_params(rng, controller):
+    lookups = controller.get_lookups()
+    return {"category_id": rng.choice(list(lookups.categories)), "status_id": rng.choice(list(lookups.status)),
+            "priority_id": rng.choice(list(lookups.priorities)), "word": rng.choice(["report", "buy", "plan"]),
+            "today": date.today().isoformat()}
+
+
+def bench(controller, users, iterations, seed=0, page_cache=False):
+    """ Run every route and method :iterations: times for random users out of :users:
+        and return their summaries by name """
+
+    rng = random.Random(seed)
+    app = create_app(controller)
+    if not page_cache:
+        app.page_cache.max_entries = 0
+    clients = {}
+    for user_id in users:
+        clients[user_id] = app.test_client()
+        clients[user_id].post("/get-started", data={"username": f"user{user_id}"})
+
+    queries = [0]
+
+    def count_query(*args):
+        queries[0] += 1
+    event.listen(controller.engine, "before_cursor_execute", count_query)
+
+    def measure(call):
+        timings = []
+        queries[0] = 0
+        for _ in range(iterations):
+            params = random_params(rng, controller)
+            start = time.perf_counter()
+            call(rng.choice(users), params)
+            timings.append(time.perf_counter() - start)
+        return summarize(timings, queries[0])
+
+    results = {}
+    for name, method, path, form in ROUTES:
+        def call(user_id, params):
+            data = {key: value.format(**params) for key, value in form.items()} if form else None
+            response = clients[user_id].open(path.format(**params), method=method, data=data)
+            assert response.status_code < 400, (name, response.status_code)
+        results[name] = measure(call)
+    for name, f in METHODS:
+        def call(user_id, params):
+            session = controller.begin_session()
+            try:
+                result = f(controller, session, user_id, params)
+                list(result.values() if isinstance(result, dict) else result)
+            finally:
+                controller.end_session()
+        results[name] = measure(call)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                    stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results, baseline=None):
+    print(f"{'name':<28}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}" +
+          (f"{'p50 chg':>10}{'p95 chg':>10}" if baseline else ""))
+    for name, result in results.items():
+        line = f"{name:<28}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}{result['queries']:>9.1f}"
+        before = (baseline or {}).get(name)
+        if before:
+            line += "".join(f"{(result[key] / before[key] - 1) * 100 if before[key] else 0:>+9.0f}%"
+                            for key in ["p50_ms", "p95_ms"])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--db-url", help="benchmark an existing DB made by generate.py instead of a fresh one")
+    parser.add_argument("--db-profile", default="production", choices=constants.SQLITE_PROFILES)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--tasks", type=int, default=100, help="tasks per user")
+    parser.add_argument("--sample-users", type=int, default=20, help="users the calls are spread over")
+    parser.add_argument("--iterations", type=int, default=200, help="calls per route and method")
+    parser.add_argument("--page-cache", action="store_true", help="keep the rendered page cache on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--base-date", type=date.fromisoformat, default=BASE_DATE, 
+                        help="YYYY-MM-DD the generated data is spread around")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        controller = Controller(args.db_url or f"sqlite:///{os.path.join(root, 'bench.db')}",
+                        os.path.join(root, "files"), args.db_profile)
+        controller.bootstrap()
+        if not args.db_url:
+            generate(controller, users=args.users, tasks=args.tasks, seed=args.seed, base_date=args.base_date)
+        session = controller.Session()
+        userIds = [user_id for user_id, in session.execute("SELECT user_id FROM users ORDER BY user_id")]
+        session.close()
+        users = random.Random(args.seed).sample(userIds, min(args.sample_users, len(userIds)))
+        results = bench(controller, users, args.iterations, args.seed, args.page_cache)
+        controller.close()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    report(results, baseline)
+    if args.output:
+        run = {"meta": {"date": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+                        "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                        "argv": sys.argv[1:], "db_profile": args.db_profile, "users": args.users,
+                        "tasks": args.tasks, "iterations": args.iterations, "seed": args.seed},
+               "results": results}
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+""" Compare the concurrent-request throughput of the JSON API on the
+    Flask app served by waitress and on the async read path served by uvicorn.
+    Both serve the same fresh DB on a local port and are driven by the same
+    keep-alive HTTP clients, each cycling through the read routes.
+
+    >> python bench_async.py --clients 32 --requests 200 """
+
+import os
+import time
+import logging
+import argparse
+import tempfile
+import http.client
+from threading import Thread
+
+import uvicorn
+import waitress
+
+import constants
+from core import Controller
+from server import create_app
+from aio import create_asgi_app
+from generate import generate
+
+
+ROUTES = ["/api/tasks", "/api/requests", "/api/assigned-tasks", "/api/activity"]
+
+
+def login(port, username):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    connection.request("POST", "/get-started", body=f"username={username}",
+        headers={"Content-Type": "application/x-www-form-urlencoded"})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.getheader("Set-Cookie").split(";")[0]
+
+
+def drive(port, cookies, clients, requests):
+    """ Send requests GETs per client from clients threads and return (requests/s, latencies) """
+
+    latencies = []
+
+    def client(number):
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        headers = {"Cookie": cookies[number % len(cookies)]}
+        for request in range(requests):
+            start = time.perf_counter()
+            connection.request("GET", ROUTES[request % len(ROUTES)], headers=headers)
+            response = connection.getresponse()
+            response.read()
+            assert response.status == 200, response.status
+            latencies.append(time.perf_counter() - start)
+        connection.close()
+
+    threads = [Thread(target=client, args=(number,)) for number in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return clients * requests / (time.perf_counter() - start), sorted(latencies)
+
+
+def start_waitress(controller, threads):
+    # Queue depth warnings are expected under this load
+    logging.getLogger("waitress.queue").setLevel(logging.ERROR)
+    server = waitress.create_server(create_app(controller), host="127.0.0.1", port=0, threads=threads)
+    Thread(target=server.run, daemon=True).start()
+    return server, server.effective_port
+
+
+def start_uvicorn(DB_URL, profile, pool_size):
+    server = uvicorn.Server(uvicorn.Config(create_asgi_app(DB_URL, profile, pool_size),
+                host="127.0.0.1", port=0, log_level="warning"))
+    thread = Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, thread, port
+
+
+def report(name, throughput, latencies):
+    percentile = lambda p: latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+    print(f"{name:<12}{throughput:>12.1f}{percentile(0.5):>10.2f}{percentile(0.99):>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--clients", type=int, default=32, help="concurrent HTTP clients")
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--tasks", type=int, default=200, help="tasks per user")
+    parser.add_argument("--threads", type=int, default=4, help="waitress threads")
+    parser.add_argument("--pool-size", type=int, default=4, help="aiosqlite connections")
+    parser.add_argument("--db-profile", default="production", choices=constants.SQLITE_PROFILES)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        DB_URL = f"sqlite:///{os.path.join(root, 'bench.db')}"
+        controller = Controller(DB_URL, os.path.join(root, "files"), args.db_profile)
+        controller.bootstrap()
+        generate(controller, users=args.users, tasks=args.tasks, groups=args.users, group_size=2,
+                 requests=args.users, assignments=args.users * 10)
+
+        _server, port = start_waitress(controller, args.threads)
+        cookies = [login(port, f"user{user_id}") for user_id in range(1, args.users + 1)]
+        print(f"{'server':<12}{'req/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+        # Left idle until exit, closing it under its own run loop raises in that thread
+        report("waitress", *drive(port, cookies, args.clients, args.requests))
+
+        server, thread, port = start_uvicorn(DB_URL, args.db_profile, args.pool_size)
+        report("asgi", *drive(port, cookies, args.clients, args.requests))
+        server.should_exit = True
+        thread.join()
+        controller.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+""" Compare read and write throughput of the SQLite profiles.
+    Every profile gets a fresh DB, then several threads add tasks and
+    read the dashboard through the Controller, one unit of work per operation
+    like the server does per request.
+
+    >> python bench_profiles.py --threads 8 --ops 500 """
+
+import os
+import time
+import argparse
+import tempfile
+from datetime import date, timedelta
+from threading import Thread
+
+import constants
+from core import Controller
+from insert import insert_defaults
+
+
+def run_threads(threads, ops, work):
+    """ Run work(thread, op) ops times on each thread and return operations per second """
+
+    def worker(thread):
+        for op in range(ops):
+            work(thread, op)
+
+    workers = [Thread(target=worker, args=(thread,)) for thread in range(threads)]
+    start = time.perf_counter()
+    for _worker in workers:
+        _worker.start()
+    for _worker in workers:
+        _worker.join()
+    return threads * ops / (time.perf_counter() - start)
+
+
+def unit_of_work(controller, f, *args):
+    controller.begin_session()
+    try:
+        return f(*args)
+    finally:
+        controller.end_session()
+
+
+def bench_profile(profile, threads, ops, root):
+    path = os.path.join(root, f"{profile}.db")
+    controller = Controller(f"sqlite:///{path}", os.path.join(root, "files"), profile)
+    controller.bootstrap()
+    session = controller.Session()
+    insert_defaults(session)
+    session.close()
+    users = [controller.signup(f"user{thread}").user_id for thread in range(threads)]
+    today = date.today()
+
+    def write(thread, op):
+        unit_of_work(controller, controller.add_task, f"task {op}", "benchmark",
+            today + timedelta(days=op % 30 - 10), users[thread], 1, 1 + op % 2, 1 + op % 3)
+
+    def read(thread, op):
+        unit_of_work(controller, controller.get_dashboard, users[thread])
+
+    writes = run_threads(threads, ops, write)
+    reads = run_threads(threads, ops, read)
+    controller.engine.dispose()
+    return writes, reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=200, help="operations per thread")
+    parser.add_argument("--profiles", nargs="+", default=list(constants.SQLITE_PROFILES),
+                        choices=constants.SQLITE_PROFILES)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        print(f"{'profile':<12}{'writes/s':>12}{'reads/s':>12}")
+        for profile in args.profiles:
+            writes, reads = bench_profile(profile, args.threads, args.ops, root)
+            print(f"{profile:<12}{writes:>12.1f}{reads:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+""" Bulk import and export of tasks as CSV or JSONL.
+
+    >> python bulk.py import --username alice tasks.csv
+    >> python bulk.py export --username alice --format jsonl > tasks.jsonl """
+
+import io
+import os
+import sys
+import csv
+import json
+import codecs
+import argparse
+from datetime import date
+
+import constants
+
+
+FORMATS = ["csv", "jsonl"]
+FIELDS = ["task_title", "task_desc", "task_date", "category_id", "status_id", "priority_id"]
+MAX_ERRORS = 100
+
+
+class InvalidRow(Exception):
+    """ Raised for an import row that can't be turned into a task """
+
+
+def read_rows(stream, fmt):
+    """ Yield (line number, row dict) from a binary CSV or JSONL stream without reading it whole """
+
+    lines = codecs.iterdecode(stream, "utf-8-sig")
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_num, row
+
+
+def validate_row(row, lookups):
+    """ Return the task columns of an import row, checking the ids against the lookup tables """
+
+    if not isinstance(row, dict):
+        raise InvalidRow("Not a JSON object")
+    task = {}
+    for field in ["task_title", "task_desc"]:
+        value = str(row.get(field) or "").strip()
+        if not value or len(value) > 256:
+            raise InvalidRow(f"{field} must be 1 to 256 characters")
+        task[field] = value
+    try:
+        task["task_date"] = date.fromisoformat(str(row.get("task_date")))
+    except ValueError:
+        raise InvalidRow("task_date must be YYYY-MM-DD")
+    for field, table in [("category_id", lookups.categories), ("status_id", lookups.status),
+                         ("priority_id", lookups.priorities)]:
+        try:
+            task[field] = int(row.get(field))
+        except (TypeError, ValueError):
+            raise InvalidRow(f"{field} must be a number")
+        if task[field] not in table:
+            raise InvalidRow(f"Unknown {field} {task[field]}")
+    return task
+
+
+def format_rows(tasks, fmt):
+    """ Yield the lines of an export, one task at a time """
+
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["task_id"] + FIELDS)
+        for task in tasks:
+            writer.writerow([task.task_id] + [getattr(task, field) for field in FIELDS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    else:
+        for task in tasks:
+            row = {field: getattr(task, field) for field in ["task_id"] + FIELDS}
+            row["task_date"] = row["task_date"].isoformat()
+            yield json.dumps(row) + "\n"
+
+
+def main():
+    from core import Controller
+
+    parser = argparse.ArgumentParser(description="Bulk import and export of tasks")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("file", nargs="?", help="file to import, stdin if omitted")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--format", choices=FORMATS, help="defaults to the file extension, or csv")
+    parser.add_argument("--db-url", default=os.environ.get("TODO_DB_URL", constants.DB_URL))
+    args = parser.parse_args()
+
+    fmt = args.format or ("jsonl" if args.file and args.file.endswith(".jsonl") else "csv")
+    controller = Controller(args.db_url, os.environ.get("TODO_FILES_DIR", constants.FILES_DIR))
+    controller.bootstrap()
+    user = controller.get_user(args.username)
+    if user is None:
+        parser.error(f"Unknown user {args.username}")
+
+    if args.command == "import":
+        stream = open(args.file, "rb") if args.file else sys.stdin.buffer
+        with stream:
+            imported, rejected, errors = controller.import_tasks(user.user_id, stream, fmt)
+        for line_num, message in errors:
+            print(f"line {line_num}: {message}", file=sys.stderr)
+        print(f"Imported {imported} tasks, {rejected} rows rejected", file=sys.stderr)
+    else:
+        for line in controller.export_tasks(user.user_id, fmt):
+            sys.stdout.write(line)
+
+
+if __name__ == "__main__":
+    main()
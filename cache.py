@@ -0,0 +1,191 @@
+import time
+import uuid
+from threading import Lock
+from collections import OrderedDict, namedtuple
+
+
+def plain_rows(rows, key):
+    """ Rows of a lookup table as namedtuples by id, so they don't depend on 
+        the session they were loaded in """
+
+    if not rows:
+        return {}
+    columns = [column.key for column in rows[0].__table__.columns]
+    Row = namedtuple(type(rows[0]).__name__, columns)
+    return {getattr(row, key): Row(*(getattr(row, column) for column in columns)) for row in rows}
+
+
+class LookupCache(object):
+    """ LookupCache keeps the small lookup tables (categories, status,
+        priorities and available activities) in memory as plain rows.
+        The version is bumped when a load changes the cached rows, so 
+        callers can tell when they have changed. An id missing after a 
+        reload is remembered for miss_ttl seconds, so it doesn't reload 
+        the tables again on every access. """
+
+    def __init__(self, loader=None, miss_ttl=60):
+        self.lock = Lock()
+        self.loader = loader
+        self.miss_ttl = miss_ttl
+        self.version = 0
+        self.loaded = False
+        self.categories = {}
+        self.status = {}
+        self.priorities = {}
+        self.activities = {}
+        self.missing = {}
+
+    def load(self, session, customer):
+        """ Load all lookup tables from the DB and swap them in at once """
+
+        categories = plain_rows(customer.get_categories(session), "category_id")
+        status = plain_rows(customer.get_status(session), "status_id")
+        priorities = plain_rows(customer.get_priorities(session), "priority_id")
+        activities = plain_rows(customer.get_all_available_activities(session), "activity_id")
+        with self.lock:
+            if (categories, status, priorities, activities) != \
+                    (self.categories, self.status, self.priorities, self.activities):
+                self.categories = categories
+                self.status = status
+                self.priorities = priorities
+                self.activities = activities
+                self.missing = {}
+                self.version += 1
+            # Tables are seeded by insert.py after the first server start,
+            # so an empty load is retried on the next access
+            self.loaded = bool(categories or status or priorities or activities)
+
+    def invalidate(self):
+        """ Reload the tables on next access """
+
+        with self.lock:
+            self.loaded = False
+            self.missing = {}
+
+    def get(self, table, key):
+        """ Return a cached row by id. A miss means the cache may be stale,
+            so the tables are reloaded once and the id looked up again.
+            None is returned if the id is still missing. """
+
+        row = getattr(self, table).get(key)
+        if row is not None or self.loader is None:
+            return row
+        if time.monotonic() - self.missing.get((table, key), float("-inf")) < self.miss_ttl:
+            return None
+        self.loader()
+        row = getattr(self, table).get(key)
+        if row is None:
+            with self.lock:
+                self.missing[(table, key)] = time.monotonic()
+        return row
+
+
+def touch(session, *user_ids):
+    """ Mark the data of users as changed by the transaction of a session.
+        Their versions are bumped once it commits. """
+
+    session.info.setdefault("touched", set()).update(int(user_id) for user_id in user_ids)
+
+
+def touch_all(session):
+    """ Mark the data of every user as changed, e.g. when a user signs up """
+
+    session.info["touched_all"] = True
+
+
+class DataVersions(object):
+    """ DataVersions keeps a version per user that changes after every
+        committed write to the user's data, so responses built from it can
+        be revalidated without querying the DB.
+        Versions live in memory; the epoch makes them unique across restarts. """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.epoch = uuid.uuid4().hex[:8]
+        self.counter = 0
+        self.floor = 0
+        self.users = {}
+
+    def get(self, user_id):
+        with self.lock:
+            return max(self.users.get(user_id, 0), self.floor)
+
+    def bump(self, *user_ids):
+        with self.lock:
+            self.counter += 1
+            for user_id in user_ids:
+                self.users[user_id] = self.counter
+
+    def bump_all(self):
+        with self.lock:
+            self.counter += 1
+            self.floor = self.counter
+
+    def after_commit(self, session):
+        """ Session listener, bumps the users touched by the committed transaction """
+
+        touched = session.info.pop("touched", None)
+        if session.info.pop("touched_all", False):
+            self.bump_all()
+        elif touched:
+            self.bump(*touched)
+
+    def after_rollback(self, session):
+        session.info.pop("touched", None)
+        session.info.pop("touched_all", None)
+
+
+class PageCache(object):
+    """ PageCache is an LRU cache of rendered pages, bounded by the number of
+        pages and their total size. A page is stored with the data version
+        it was rendered from and only served while the version is unchanged. """
+
+    def __init__(self, max_entries=1000, max_bytes=32 * 1024 * 1024):
+        self.lock = Lock()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.pages = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id, path, version):
+        """ Return the cached page, or None if it is missing or was rendered from an older version """
+
+        key = (user_id, path)
+        with self.lock:
+            entry = self.pages.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.pages.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id, path, version, page):
+        if len(page) > self.max_bytes:
+            return
+        key = (user_id, path)
+        with self.lock:
+            entry = self.pages.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry[1])
+            self.pages[key] = (version, page)
+            self.size += len(page)
+            while len(self.pages) > self.max_entries or self.size > self.max_bytes:
+                _key, (_version, _page) = self.pages.popitem(last=False)
+                self.size -= len(_page)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.pages.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, 
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "evictions": self.evictions, "entries": len(self.pages), "bytes": self.size}
@@ -1,7 +1,92 @@
+## Flask session signing key, shared by the async read path
+SECRET_KEY = "SECRET_KEY"
+
 ## Status
 ONGOING = 1
 COMPLETED = 2
 
 ## Available Activity 
 ADDED = 1
-UPDATED = 2
\ No newline at end of file
+UPDATED = 2
+
+## Dashboard
+DASHBOARD_BUCKETS = ["overdue", "today", "tomorrow", "upcoming", "completed"]
+DASHBOARD_LIMIT = 50
+COMPLETED_LIMIT = 10
+DASHBOARD_MAX_LIMIT = 1000
+
+## Files
+FILES_DIR = "files"
+FILE_MIGRATION_BATCH = 100
+MAX_UPLOAD_SIZE = 16 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+## Pagination
+PAGE_SIZE = 50
+
+## Activity log write-behind
+LOG_BUFFER_SIZE = 100
+LOG_FLUSH_INTERVAL = 1.0
+
+## Activity log archive, logs older than the retention are moved into compressed segments
+ACTIVITY_RETENTION_DAYS = 90
+ARCHIVE_INTERVAL = 3600
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_PAUSE = 0.05
+ARCHIVE_SEGMENT_ROWS = 5000
+
+## Deleted tasks are tombstoned and removed in the background
+PURGE_INTERVAL = 60
+PURGE_BATCH_SIZE = 500
+PURGE_PAUSE = 0.05
+
+## SQLite pragmas applied on every new connection
+SQLITE_PROFILES = {
+    "default": {},
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -65536,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "foreign_keys": "ON",
+    },
+}
+DB_URL = "sqlite:///todo.db"
+DB_PROFILE = "production"
+
+## Writer thread group commit
+WRITE_BATCH_SIZE = 64
+WRITE_BATCH_DELAY = 0.0
+
+## Bulk import and export
+IMPORT_BATCH_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+
+## Bulk task operations, most tasks per request
+BULK_MAX_TASKS = 1000
+BULK_MAX_DAYS = 3650
+
+## JSON API
+API_MAX_LIMIT = 500
+
+## Rendered page cache
+PAGE_CACHE_SIZE = 1000
+PAGE_CACHE_BYTES = 32 * 1024 * 1024
+
+## Queries slower than this are logged with their query plan, 0 turns it off
+SLOW_QUERY_MS = 100
+
+## Metrics histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+QUERY_COUNT_BUCKETS = [1, 2, 5, 10, 20, 50, 100]
+
+## Server-sent events, every open stream holds one of the server threads
+SERVER_THREADS = 16
+SSE_MAX_STREAMS = 8
+SSE_STREAMS_PER_USER = 2
+SSE_QUEUE_SIZE = 100
+SSE_KEEPALIVE = 5
+SSE_MAX_DURATION = 300
+SSE_RETRY_MS = 3000
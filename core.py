@@ -1,5 +1,20 @@
-from models import SQLBackend, Customer
-from decorator import handle_session
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event
+
+import constants
+from models import SQLBackend, Customer, Task, TaskAssignment, ActivityLog, on_commit
+from decorator import handle_session, handle_write
+from cache import LookupCache, DataVersions, touch, touch_all
+from storage import BlobStore
+from pagination import paginate, decode_cursor
+from writebehind import ActivityLogBuffer
+from archive import ActivityArchiver, pack_logs, unpack_logs
+from purge import TaskPurger
+from events import EventHub, notify
+from writer import WriteQueue
+from slowlog import SlowQueryLog
+from bulk import InvalidRow, read_rows, validate_row, format_rows, MAX_ERRORS
 
 
 class Controller(SQLBackend):
@@ -7,13 +22,118 @@ class Controller(SQLBackend):
         composition from Customer class. 
         Controller class is responsible for handling the session in the DB """
 
-    def __init__(self, DB_URL):
-        super().__init__(DB_URL)
+    def __init__(self, DB_URL, files_dir=constants.FILES_DIR, profile="default"):
+        super().__init__(DB_URL, profile)
         self.customer = Customer()
+        self.lookups = LookupCache(self.load_lookups)
+        self.versions = DataVersions()
+        event.listen(self.Session, "after_commit", self.versions.after_commit)
+        event.listen(self.Session, "after_rollback", self.versions.after_rollback)
+        self.events = EventHub(constants.SSE_MAX_STREAMS, constants.SSE_QUEUE_SIZE, constants.SSE_STREAMS_PER_USER)
+        event.listen(self.Session, "after_commit", self.events.after_commit)
+        event.listen(self.Session, "after_rollback", self.events.after_rollback)
+        self.files = BlobStore(files_dir)
+        self.log_buffer = None
+        self.write_queue = None
+        self.slow_query_log = None
+        self.archiver = None
+        self.purger = None
+
+    def enable_log_buffer(self, max_rows=constants.LOG_BUFFER_SIZE, interval=constants.LOG_FLUSH_INTERVAL):
+        """ Write activity logs behind the task writes in batches. 
+            Trades the atomicity of task and log for fewer commits. """
+
+        if self.log_buffer is None:
+            self.log_buffer = ActivityLogBuffer(self.write_activity_logs, max_rows, interval)
+        return self.log_buffer
+
+    def enable_write_queue(self, max_batch=constants.WRITE_BATCH_SIZE, max_delay=constants.WRITE_BATCH_DELAY):
+        """ Run all writes on a single writer thread with group commit """
+
+        if self.write_queue is None:
+            self.write_queue = WriteQueue(self, max_batch, max_delay)
+        return self.write_queue
+
+    def enable_slow_query_log(self, threshold_ms=constants.SLOW_QUERY_MS):
+        """ Log queries slower than threshold_ms with the method that ran them and their query plan """
+
+        if self.slow_query_log is None:
+            self.slow_query_log = SlowQueryLog(self.engine, threshold_ms / 1000)
+        return self.slow_query_log
+
+    def enable_archiver(self, retention_days=constants.ACTIVITY_RETENTION_DAYS, interval=constants.ARCHIVE_INTERVAL):
+        """ Move activity logs older than retention_days into the archive in the background """
+
+        if self.archiver is None:
+            self.archiver = ActivityArchiver(self, retention_days, interval)
+        return self.archiver
+
+    def enable_purger(self, interval=constants.PURGE_INTERVAL):
+        """ Remove deleted tasks and their activity logs in the background """
+
+        if self.purger is None:
+            self.purger = TaskPurger(self, interval)
+        return self.purger
+
+    def bootstrap(self):
+        super().bootstrap()
+        self.check_counters()
+
+    def close(self):
+        if self.purger is not None:
+            self.purger.close()
+            self.purger = None
+        if self.archiver is not None:
+            self.archiver.close()
+            self.archiver = None
+        if self.log_buffer is not None:
+            # Stops the flusher while the write queue still runs its flushes
+            self.log_buffer.close()
+        if self.write_queue is not None:
+            self.write_queue.close()
+            self.write_queue = None
+        if self.log_buffer is not None:
+            # Logs of the writes that were still queued
+            self.log_buffer.flush()
+            self.log_buffer = None
+
+    ### METHODS FOR LOOKUP TABLES
+    def get_lookups(self):
+        """ Return the lookup cache, loading it from the DB on first use """
+
+        if not self.lookups.loaded:
+            self.load_lookups()
+        return self.lookups
+
+    def load_lookups(self):
+        """ Load the lookup tables in a session of their own, so a rollback 
+            of the request or writer session can't touch the cached rows """
+
+        session = self.Session()
+        try:
+            self.lookups.load(session, self.customer)
+        finally:
+            session.close()
+
+    def invalidate_lookups(self):
+        """ Call after changing categories, status, priorities or activities """
+
+        self.lookups.invalidate()
+
+    ### METHODS FOR DATA VERSIONS
+    def get_data_version(self, user_id):
+        """ Version of everything a user can see. It changes after any committed 
+            write to the user's data or a reload of the lookup tables. 
+            Read it before the data, so a write in between only makes it older. """
+
+        return f"{self.versions.epoch}.{self.lookups.version}.{self.versions.get(user_id)}"
 
     ### METHODS FOR TASK
+    @handle_write
     @handle_session
     def signup(self, session, username):
+        # New users show up in everyone's list of users
+        touch_all(session)
         user = self.customer.signup(session, username)
         return user
     
@@ -22,114 +142,405 @@ class Controller(SQLBackend):
         user = self.customer.get_user(session, username)
         return user
 
+    def commit_activity(self, session, user_id, activity, task_id):
+        """ Commit the current transaction together with its activity log. 
+            With the write-behind buffer the log is buffered once the commit succeeded. """
+
+        activity_id = self.get_available_activities(activity).activity_id
+        if self.log_buffer is None:
+            self.customer.add_activity_log(session, user_id, activity_id, task_id, datetime.now(), commit=False)
+            self.customer.save(session)
+        else:
+            on_commit(session, self.log_buffer.add, user_id, activity_id, task_id, datetime.now())
+            self.customer.save(session)
+
+    @handle_write
+    @handle_session
+    def write_activity_logs(self, session, activities):
+        """ Commit activity log rows of the write-behind buffer """
+
+        touch(session, *{row["user_id"] for row in activities})
+        logs = self.customer.add_activity_logs(session, activities)
+        return logs
+
+    def commit_activities(self, session, user_id, activity, task_ids):
+        """ Commit the current transaction together with one activity log per task, 
+            written with one executemany. With the write-behind buffer the logs are 
+            buffered once the commit succeeded. """
+
+        activity_id = self.get_available_activities(activity).activity_id
+        log_date = datetime.now()
+        activities = [{"user_id": user_id, "activity_id": activity_id, "task_id": task_id, "log_date": log_date} 
+                        for task_id in task_ids]
+        if self.log_buffer is None:
+            self.customer.add_activity_logs(session, activities, commit=False)
+            self.customer.save(session)
+        else:
+            for row in activities:
+                on_commit(session, self.log_buffer.add, user_id, activity_id, row["task_id"], log_date)
+            self.customer.save(session)
+
+    @handle_write
     @handle_session
     def add_task(self, session, task_title, task_desc, task_date, user_id, category_id, status_id, priority_id):
+        """ Add a task and log it in one transaction """
+
+        touch(session, user_id)
         task = self.customer.add_task(session, task_title, task_desc, task_date, 
-                    user_id, category_id, status_id, priority_id)
+                    user_id, category_id, status_id, priority_id, commit=False)
+        self.customer.count_tasks(session, added=[task])
+        self.commit_activity(session, user_id, constants.ADDED, task.task_id)
         return task
 
-    @handle_session
-    def get_categories(self, session):
-        categories = self.customer.get_categories(session)
+    def get_categories(self):
+        categories = list(self.get_lookups().categories.values())
         return categories
 
-    @handle_session
-    def get_status(self, session):
-        status = self.customer.get_status(session)
+    def get_status(self):
+        status = list(self.get_lookups().status.values())
         return status
 
-    @handle_session
-    def get_priorities(self, session):
-        priorities = self.customer.get_priorities(session)
+    def get_priorities(self):
+        priorities = list(self.get_lookups().priorities.values())
         return priorities
 
+    @handle_session
+    def get_tasks(self, session, user_id, after=None, limit=constants.PAGE_SIZE):
+        """ A page of tasks of a user. :after: is the cursor of the previous page. """
+
+        tasks = self.customer.get_tasks(session, user_id, self.get_lookups(), 
+                    decode_cursor(after, int), limit + 1)
+        return paginate(tasks, limit, lambda row: (row[0].task_id,))
 
     @handle_session
-    def get_tasks(self, session, user_id):
-        tasks = self.customer.get_tasks(session, user_id)
-        return tasks
+    def get_dashboard(self, session, user_id, limits=None):
+        """ Tasks of a user split into overdue, today, tomorrow, upcoming and completed.
+            :limits: optional maximum number of tasks per bucket. """
+
+        bucketLimits = {name: constants.DASHBOARD_LIMIT for name in constants.DASHBOARD_BUCKETS}
+        bucketLimits["completed"] = constants.COMPLETED_LIMIT
+        bucketLimits.update(limits or {})
+        taskCounts = self.get_task_counts(user_id)
+        dashboard = self.customer.get_dashboard(session, user_id, date.today(), bucketLimits, self.get_lookups(),
+                        {name: taskCounts[name] for name in constants.DASHBOARD_BUCKETS})
+        return dashboard
 
     @handle_session
     def get_task(self, session, task_id):
-        task = self.customer.get_task(session, task_id)
+        task = self.customer.get_task(session, task_id, self.get_lookups())
         return task
 
+    @handle_write
     @handle_session
-    def update_task(self, session, task_id, task_title, task_desc, task_date, category_id, status_id, priority_id):
+    def update_task(self, session, task_id, task_title, task_desc, task_date, category_id, status_id, priority_id, 
+                    user_id):
+        """ Update a task and log it in one transaction """
+
+        old = self.customer.get_task_fields(session, task_id)
+        if old is None:
+            # Missing or deleted, nothing to update or log
+            return 0
+        # The task belongs to its owner, the activity log to the caller
+        touch(session, old.user_id, user_id)
         task = self.customer.update_task(session, task_id, task_title, 
-                        task_desc, task_date, category_id, status_id, priority_id)
+                        task_desc, task_date, category_id, status_id, priority_id, commit=False)
+        new = Task(user_id=old.user_id, task_date=task_date, category_id=category_id, 
+                    status_id=status_id, priority_id=priority_id)
+        self.customer.count_tasks(session, added=[new], removed=[old])
+        self.commit_activity(session, user_id, constants.UPDATED, task_id)
         return task
     
+    @handle_write
     @handle_session
     def delete_task(self, session, task_id):
-        task = self.customer.delete_task(session, task_id)
+        """ Tombstone a task. It disappears from every read at once, 
+            the purger removes it and its activity logs later. """
+
+        old = self.customer.get_task_fields(session, task_id)
+        if old is not None:
+            touch(session, old.user_id)
+            self.customer.count_tasks(session, removed=[old])
+        if self.log_buffer is not None:
+            on_commit(session, self.log_buffer.discard, task_id)
+        task = self.customer.delete_task(session, task_id, datetime.now(), commit=False)
+        self.customer.save(session)
         return task
 
+    @handle_write
+    @handle_session
+    def update_tasks(self, session, user_id, task_ids, status_id=None, days=0):
+        """ Set the status and/or move the date by :days: of many tasks of a user with 
+            one UPDATE, logged with one executemany in the same transaction. 
+            Tasks of other users are skipped. Returns the number of updated tasks. """
+
+        old = self.customer.get_tasks_fields(session, user_id, task_ids)
+        if not old or (status_id is None and not days):
+            return 0
+        touch(session, user_id)
+        new = [Task(user_id=task.user_id, task_date=task.task_date + timedelta(days=days), 
+                    category_id=task.category_id, status_id=task.status_id if status_id is None else status_id, 
+                    priority_id=task.priority_id) for task in old]
+        self.customer.count_tasks(session, added=new, removed=old)
+        taskIds = [task.task_id for task in old]
+        tasks = self.customer.update_tasks(session, taskIds, status_id, days, commit=False)
+        self.commit_activities(session, user_id, constants.UPDATED, taskIds)
+        return tasks
+
+    @handle_write
+    @handle_session
+    def delete_tasks(self, session, user_id, task_ids):
+        """ Tombstone many tasks of a user with one UPDATE. Tasks of other users are skipped. """
+
+        old = self.customer.get_tasks_fields(session, user_id, task_ids)
+        if not old:
+            return 0
+        touch(session, user_id)
+        self.customer.count_tasks(session, removed=old)
+        taskIds = [task.task_id for task in old]
+        if self.log_buffer is not None:
+            on_commit(session, self.log_buffer.discard, *taskIds)
+        tasks = self.customer.delete_tasks(session, taskIds, datetime.now(), commit=False)
+        self.customer.save(session)
+        return tasks
+
+    @handle_write
+    @handle_session
+    def purge_tasks(self, session, batch_size=constants.PURGE_BATCH_SIZE):
+        """ Remove up to batch_size tombstoned tasks and their activity logs in one transaction """
+
+        tasks = self.customer.purge_tasks(session, batch_size)
+        return tasks
+
     @handle_session
-    def get_tasks_by_category(self, session, user_id, category_id):
-        tasksByCategory = self.customer.get_tasks_by_category(session, user_id, category_id)
-        return tasksByCategory
+    def get_tasks_by_category(self, session, user_id, category_id, after=None, limit=constants.PAGE_SIZE):
+        tasksByCategory = self.customer.get_tasks_by_category(session, user_id, category_id, 
+                    decode_cursor(after, int), limit + 1)
+        return paginate(tasksByCategory, limit, lambda row: (row[0].task_id,))
 
     @handle_session
-    def get_tasks_by_status(self, session, user_id, status_id):
-        tasksByStatus = self.customer.get_tasks_by_status(session, user_id, status_id)
-        return tasksByStatus
+    def get_tasks_by_status(self, session, user_id, status_id, after=None, limit=constants.PAGE_SIZE):
+        tasksByStatus = self.customer.get_tasks_by_status(session, user_id, status_id, 
+                    decode_cursor(after, int), limit + 1)
+        return paginate(tasksByStatus, limit, lambda row: (row[0].task_id,))
 
     @handle_session
-    def get_tasks_by_priority(self, session, user_id, priority_id):
-        tasksByPriority = self.customer.get_tasks_by_priority(session, user_id, priority_id)
-        return tasksByPriority
+    def get_tasks_by_priority(self, session, user_id, priority_id, after=None, limit=constants.PAGE_SIZE):
+        tasksByPriority = self.customer.get_tasks_by_priority(session, user_id, priority_id, 
+                    decode_cursor(after, int), limit + 1)
+        return paginate(tasksByPriority, limit, lambda row: (row[0].task_id,))
     
     @handle_session
-    def search_by(self, session, user_id, parameter):
-        searchByParameter = self.customer.search_by(session, user_id, parameter)
-        return searchByParameter
+    def search_by(self, session, user_id, parameter, after=None, limit=constants.PAGE_SIZE):
+        searchByParameter = self.customer.search_by(session, user_id, parameter, self.fts_enabled, 
+                                decode_cursor(after, float, int), limit + 1)
+        page = paginate(searchByParameter, limit, lambda row: (row[1], row[0].task_id))
+        return page._replace(items=[task for task, rank in page.items])
+
+    @handle_session
+    def search_assigned_tasks(self, session, user_id, parameter, limit=constants.PAGE_SIZE):
+        assignedTasks = list(self.customer.search_assigned_tasks(session, user_id, parameter, 
+                            self.fts_enabled, limit))
+        return assignedTasks
     
+    ### METHODS FOR BULK IMPORT AND EXPORT
+    def import_tasks(self, user_id, stream, fmt, batch_size=constants.IMPORT_BATCH_SIZE):
+        """ Stream tasks from a CSV or JSONL file into the DB, batch_size rows per insert. 
+            Invalid rows are skipped. Returns the number of imported tasks, 
+            the number of rejected rows and the first MAX_ERRORS (line, error) pairs. """
+
+        lookups = self.get_lookups()
+        imported, rejected, errors = 0, 0, []
+        batch = []
+        for line_num, row in read_rows(stream, fmt):
+            try:
+                task = validate_row(row, lookups)
+            except InvalidRow as error:
+                rejected += 1
+                if len(errors) < MAX_ERRORS:
+                    errors.append((line_num, str(error)))
+                continue
+            task["user_id"] = user_id
+            batch.append(task)
+            if len(batch) >= batch_size:
+                imported += self.add_tasks(batch)
+                batch = []
+        if batch:
+            imported += self.add_tasks(batch)
+        return imported, rejected, errors
+
+    @handle_write
+    @handle_session
+    def add_tasks(self, session, tasks):
+        touch(session, *{task["user_id"] for task in tasks})
+        self.customer.count_tasks(session, added=[Task(**task) for task in tasks])
+        tasks = self.customer.add_tasks(session, tasks)
+        return tasks
+
+    def export_tasks(self, user_id, fmt, batch_size=constants.EXPORT_BATCH_SIZE):
+        """ Yield the tasks of a user as CSV or JSONL lines, loading one page at a time """
+
+        return format_rows(self.iter_tasks(user_id, batch_size), fmt)
+
+    def iter_tasks(self, user_id, batch_size):
+        after = None
+        while True:
+            page = self.get_tasks(user_id, after, batch_size)
+            for task, category, status, priority in page.items:
+                yield task
+            if page.next_cursor is None:
+                return
+            after = page.next_cursor
+
     ### METHODS FOR LOGS
+    @handle_write
     @handle_session
     def add_activity_log(self, session, user_id, activity_id, task_id, log_date):
+        touch(session, user_id)
         activity = self.customer.add_activity_log(session, user_id, activity_id, task_id, log_date)
         return activity
     
     @handle_session
-    def get_all_activities(self, session, user_id):
-        activities = self.customer.get_all_activities(session, user_id)
-        return activities
+    def get_all_activities(self, session, user_id, after=None, limit=constants.PAGE_SIZE):
+        activities = self.customer.get_all_activities(session, user_id, 
+                        decode_cursor(after, datetime.fromisoformat, int), limit + 1)
+        return paginate(activities, limit, lambda row: (row[0].log_date, row[0].log_id))
 
-    @handle_session
-    def get_available_activities(self, session, activity_id):
-        availableActivities = self.customer.get_available_activities(session, activity_id)
+    def get_available_activities(self, activity_id):
+        availableActivities = self.get_lookups().get("activities", activity_id)
         return availableActivities
 
+    @handle_write
     @handle_session
     def delete_activity_log(self, session, task_id):
+        touch(session, *self.customer.get_task_owner(session, task_id))
         activity = self.customer.delete_activity_log(session, task_id)
         return activity
 
+    @handle_write
+    @handle_session
+    def archive_activities(self, session, before, batch_size=constants.ARCHIVE_BATCH_SIZE):
+        """ Move up to batch_size activity logs logged before :before: into the archive 
+            segments of their user and month in one transaction. Returns the number moved. """
+
+        logs = self.customer.get_old_activities(session, before, batch_size)
+        months = {}
+        for log in logs:
+            months.setdefault((log.user_id, log.log_date.strftime("%Y-%m")), []).append(log)
+        for (user_id, month), _logs in months.items():
+            segment = self.customer.get_open_segment(session, user_id, month, 
+                        constants.ARCHIVE_SEGMENT_ROWS - len(_logs))
+            rows = unpack_logs(segment.data) if segment is not None else []
+            rows += [[log.log_id, log.activity_id, log.task_id, log.log_date.isoformat()] for log in _logs]
+            dates = [datetime.fromisoformat(row[3]) for row in rows]
+            self.customer.save_segment(session, segment, user_id, month, pack_logs(rows), 
+                        min(dates), max(dates), len(rows), commit=False)
+        if logs:
+            touch(session, *{log.user_id for log in logs})
+            self.customer.delete_activities(session, [log.log_id for log in logs], commit=False)
+            self.customer.save(session)
+        return len(logs)
+
+    @handle_session
+    def get_archive_months(self, session, user_id):
+        """ Months with archived activity logs of a user, newest first, with their number of logs """
+
+        months = self.customer.get_archive_months(session, user_id)
+        return months
+
+    @handle_session
+    def get_archived_activities(self, session, user_id, month):
+        """ Archived activities of a user in a month, newest first, 
+            as the same rows as get_all_activities. Logs of deleted tasks are left out. """
+
+        rows = []
+        for segment in self.customer.get_archive_segments(session, user_id, month):
+            rows += unpack_logs(segment.data)
+        tasks = {task.task_id: task for task in self.customer.get_tasks_by_ids(session, {row[2] for row in rows})}
+        user = self.customer.get_assignee(session, user_id).first()
+        activities = []
+        for log_id, activity_id, task_id, log_date in sorted(rows, key=lambda row: (row[3], row[0]), reverse=True):
+            if task_id in tasks:
+                log = ActivityLog(log_id=log_id, user_id=user_id, activity_id=activity_id, 
+                                  task_id=task_id, log_date=datetime.fromisoformat(log_date))
+                activities.append((log, user, self.get_available_activities(activity_id), tasks[task_id]))
+        return activities
+
     ### METHODS FOR FILE
+    def add_file(self, file_name, file_stream, user_id, max_size=None):
+        """ Stream a file into the BlobStore and save its metadata.
+            Raises FileTooLarge when the file is bigger than max_size. """
+
+        file_hash, file_size = self.files.put_stream(file_stream, constants.UPLOAD_CHUNK_SIZE, max_size, hold=True)
+        try:
+            _file = self.save_file(file_name, file_hash, file_size, user_id)
+        finally:
+            self.files.release(file_hash)
+        return _file
+
+    @handle_write
     @handle_session
-    def add_file(self, session, file_name, file_data, user_id):
-        _file = self.customer.add_file(session, file_name, file_data, user_id)
+    def save_file(self, session, file_name, file_hash, file_size, user_id):
+        touch(session, user_id)
+        _file = self.customer.add_file(session, file_name, file_hash, file_size, user_id)
         return _file
     
     @handle_session
-    def get_files(self, session, user_id):
-        _files = self.customer.get_files(session, user_id)
-        return _files
+    def get_files(self, session, user_id, after=None, limit=constants.PAGE_SIZE):
+        _files = self.customer.get_files(session, user_id, decode_cursor(after, int), limit + 1)
+        return paginate(_files, limit, lambda row: (row.file_id,))
 
     @handle_session
     def download_file(self, session, user_id, file_id):
         _file = self.customer.download_file(session, user_id, file_id)
         return _file
 
+    def get_file_path(self, file_hash):
+        return self.files.path(file_hash)
+
+    @handle_write
     @handle_session
     def delete_file(self, session, file_id):
-        _file = self.customer.delete_file(session, file_id)
-        return _file
+        """ Delete a file and its blob once no other file shares it """
+
+        _file = self.customer.get_file(session, file_id)
+        if _file is not None:
+            touch(session, _file.user_id)
+        deleted = self.customer.delete_file(session, file_id, commit=False)
+        if _file is not None and _file.file_hash and not self.customer.count_file_refs(session, _file.file_hash):
+            on_commit(session, self.delete_blob, _file.file_hash)
+        self.customer.save(session)
+        return deleted
+
+    def delete_blob(self, file_hash):
+        """ Remove a blob after its last file was deleted. The references are counted 
+            again under the BlobStore lock, as an upload of the same body may have 
+            saved a new file since. """
+
+        session = self.Session()
+        try:
+            return self.files.delete(file_hash, lambda: self.customer.count_file_refs(session, file_hash) > 0)
+        finally:
+            session.close()
+
+    @handle_session
+    def migrate_files(self, session, batch_size=constants.FILE_MIGRATION_BATCH):
+        """ Move file bodies still stored in the DB to the BlobStore """
+
+        moved = 0
+        fileIds = self.customer.get_files_in_db(session, batch_size)
+        while fileIds:
+            for file_id in fileIds:
+                self.customer.move_file_data(session, file_id, self.files)
+                moved += 1
+            session.expunge_all()
+            fileIds = self.customer.get_files_in_db(session, batch_size)
+        return moved
 
     ### METHODS FOR GROUPS
+    @handle_write
     @handle_session
     def create_group(self, session, group_name, user_id):
+        touch(session, user_id)
         group = self.customer.create_group(session, group_name, user_id)
         return group
     
@@ -143,8 +554,11 @@ class Controller(SQLBackend):
         groups = self.customer.get_groups_created_by_user(session, user_id)
         return groups
 
+    @handle_write
     @handle_session
     def send_request(self, session, group_id, receiver_id, sender_id):
+        touch(session, receiver_id)
+        notify(session, "request", {"group_id": int(group_id), "sender_id": int(sender_id)}, receiver_id)
         request = self.customer.send_request(session, group_id, receiver_id, sender_id)
         return request
 
@@ -153,13 +567,18 @@ class Controller(SQLBackend):
         request = self.customer.get_request(session, receiver_id)
         return request
 
+    @handle_write
     @handle_session
     def delete_request(self, session, group_id, receiver_id):
+        touch(session, receiver_id)
         request = self.customer.delete_request(session, group_id, receiver_id)
         return request
 
+    @handle_write
     @handle_session
     def add_user_in_group(self, session, group_id, user_id):
+        # Every member sees the members of the group
+        touch(session, user_id, *self.customer.get_group_user_ids(session, group_id))
         userInGroup = self.customer.add_user_in_group(session, group_id, user_id)
         return userInGroup
 
@@ -173,19 +592,66 @@ class Controller(SQLBackend):
         usersInGroup = self.customer.get_users_in_group(session, group_id)
         return usersInGroup
 
+    @handle_session
+    def get_group_user_ids(self, session, group_id):
+        userIds = self.customer.get_group_user_ids(session, group_id)
+        return userIds
+
+    @handle_session
+    def get_group_members(self, session, user_id):
+        groupMembers = self.customer.get_group_members(session, user_id)
+        return groupMembers
+
+    @handle_session
+    def get_groups_page(self, session, user_id):
+        """ All data of the groups page loaded in one session """
+
+        groupsPage = {
+            "users": self.customer.get_all_users(session, user_id).all(),
+            "groups_created_by_user": self.customer.get_groups_created_by_user(session, user_id).all(),
+            "groupsDict": self.customer.get_group_members(session, user_id),
+            "assigned_task": self.customer.get_assigned_tasks(session, user_id, self.get_lookups())
+        }
+        return groupsPage
+
     @handle_session
     def get_group(self, session, group_id):
         group = self.customer.get_group(session, group_id)
         return group
 
     ### METHODS FOR ASSIGNING TASK TO OTHERS
+    @handle_write
     @handle_session
     def assign_task(self, session, task_title, task_desc, task_date, category_id, status_id, priority_id,  assigner_id, assignee_id, group_id):
+        touch(session, assigner_id, assignee_id)
         assignedTask = self.customer.assign_task(session, task_title, task_desc, 
                         task_date, category_id, status_id, priority_id,  
-                        assigner_id, assignee_id, group_id)
+                        assigner_id, assignee_id, group_id, commit=False)
+        self.customer.count_assignments(session, added=[assignedTask])
+        notify(session, "assigned", {"task_id": assignedTask.task_id, "task_title": task_title, 
+               "assigner_id": int(assigner_id), "group_id": int(group_id)}, assignee_id)
+        self.customer.save(session)
         return assignedTask
 
+    @handle_write
+    @handle_session
+    def assign_task_to_group(self, session, task_title, task_desc, task_date, category_id, status_id, priority_id, 
+                             assigner_id, group_id, exclude=()):
+        """ Assign a task to every member of a group but the :exclude: user ids in one 
+            transaction. Returns assignee id -> assigned task id. """
+
+        assigned = self.customer.assign_task_to_group(session, task_title, task_desc, task_date, 
+                        category_id, status_id, priority_id, assigner_id, group_id, exclude, commit=False)
+        if assigned:
+            touch(session, assigner_id, *assigned)
+            self.customer.count_assignments(session, added=[TaskAssignment(assigner_id=assigner_id, 
+                assignee_id=assignee_id, status_id=status_id) for assignee_id in assigned])
+            for assignee_id, task_id in assigned.items():
+                notify(session, "assigned", {"task_id": task_id, "task_title": task_title, 
+                       "assigner_id": int(assigner_id), "group_id": int(group_id)}, assignee_id)
+        self.customer.save(session)
+        return assigned
+
     @handle_session
     def get_assignee(self, session, assignee_id):
         assignee = self.customer.get_assignee(session, assignee_id)
@@ -193,20 +659,79 @@ class Controller(SQLBackend):
 
     @handle_session
     def get_assigned_tasks(self, session, user_id):
-        assignedTasks = self.customer.get_assigned_tasks(session, user_id)
+        assignedTasks = self.customer.get_assigned_tasks(session, user_id, self.get_lookups())
         return assignedTasks
     
     @handle_session
     def track_assigned_task(self, session, user_id):
-        assignedTasks = self.customer.track_assigned_task(session, user_id)
+        assignedTasks = self.customer.track_assigned_task(session, user_id, self.get_lookups())
         return assignedTasks
 
+    @handle_write
     @handle_session
     def update_assigned_task(self, session, task_id, status_id):
-        assignedTasks = self.customer.update_assigned_task(session, task_id, status_id)
+        old = self.customer.get_assignment_fields(session, task_id)
+        if old is not None:
+            touch(session, old.assigner_id, old.assignee_id)
+            new = TaskAssignment(assigner_id=old.assigner_id, assignee_id=old.assignee_id, status_id=status_id)
+            self.customer.count_assignments(session, added=[new], removed=[old])
+            notify(session, "assigned_update", {"task_id": int(task_id), "status_id": int(status_id)}, 
+                   old.assigner_id, old.assignee_id)
+        assignedTasks = self.customer.update_assigned_task(session, task_id, status_id, commit=False)
+        self.customer.save(session)
         return assignedTasks
    
     @handle_session
     def get_assigned_task(self, session, task_id):
         assignedTask = self.customer.get_assigned_task(session, task_id)
-        return assignedTask
\ No newline at end of file
+        return assignedTask
+
+    ### METHODS FOR TASK COUNTERS
+    @handle_session
+    def get_task_counts(self, session, user_id):
+        """ Badge counts of a user read from the task counters by primary key, 
+            so they cost the same whatever the number of tasks. """
+
+        today = date.today()
+        tomorrow = today + timedelta(days=1)
+        lookups = self.get_lookups()
+        names = {"status": [f"status:{_id}" for _id in lookups.status],
+                 "categories": [f"category:{_id}" for _id in lookups.categories],
+                 "priorities": [f"priority:{_id}" for _id in lookups.priorities],
+                 "assigned": [f"assigned:{_id}" for _id in lookups.status],
+                 "tracked": [f"tracked:{_id}" for _id in lookups.status]}
+        counters = self.customer.get_counters(session, user_id, ["tasks", "overdue", "overdue_day", 
+                        f"due:{today.isoformat()}", f"due:{tomorrow.isoformat()}"] + sum(names.values(), []))
+        overdue = self.customer.get_overdue(session, user_id, today, counters)
+        taskCounts = {key: {int(name.split(":")[1]): counters.get(name, 0) for name in _names} 
+                        for key, _names in names.items()}
+        taskCounts.update({
+            "tasks": counters.get("tasks", 0),
+            "overdue": overdue,
+            "today": counters.get(f"due:{today.isoformat()}", 0),
+            "tomorrow": counters.get(f"due:{tomorrow.isoformat()}", 0),
+            "completed": taskCounts["status"].get(constants.COMPLETED, 0)
+        })
+        taskCounts["upcoming"] = taskCounts["status"].get(constants.ONGOING, 0) - overdue - \
+                                    taskCounts["today"] - taskCounts["tomorrow"]
+        return taskCounts
+
+    @handle_write
+    @handle_session
+    def rebuild_counters(self, session, user_id=None):
+        """ Recount the task counters of a user, or of all users, to repair any drift. 
+            Returns the number of counters written. """
+
+        if user_id is None:
+            touch_all(session)
+        else:
+            touch(session, user_id)
+        counters = self.customer.rebuild_counters(session, date.today(), user_id)
+        return counters
+
+    @handle_session
+    def check_counters(self, session):
+        """ Build the task counters of a DB that has tasks but no counters yet """
+
+        if not self.customer.has_counters(session):
+            self.rebuild_counters()
@@ -0,0 +1,27 @@
+""" Rebuild the task counters from the tasks and assigned tasks tables, 
+    e.g. after rows were changed outside the app. The app keeps them up
+    to date by itself, so this is only needed to repair drift.
+
+    >> python counters.py --db-url sqlite:///todo.db --user-id 5 """
+
+import os
+import argparse
+
+import constants
+from core import Controller
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the task counters")
+    parser.add_argument("--db-url", default=os.environ.get("TODO_DB_URL", constants.DB_URL))
+    parser.add_argument("--user-id", type=int, help="rebuild the counters of this user only")
+    args = parser.parse_args()
+
+    controller = Controller(args.db_url, os.environ.get("TODO_FILES_DIR", constants.FILES_DIR))
+    controller.bootstrap()
+    counters = controller.rebuild_counters(args.user_id)
+    print(f"Rebuilt {counters} counters")
+
+
+if __name__ == "__main__":
+    main()
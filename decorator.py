@@ -1,23 +1,44 @@
 from functools import wraps
 
 from sqlalchemy.exc import IntegrityError
-from flask import redirect, session
+from sqlalchemy.orm import Query
+from flask import redirect, session, jsonify
 
 
 def handle_session(f):
-    """ Handle session for DB transactions """
+    """ Handle session for DB transactions. 
+        Reuses the session of the current request or of an outer Controller call, 
+        otherwise opens one for this call. Queries are run before returning. """
 
+    @wraps(f)
     def wrapper(self, *args, **kwargs):
-        session = self.Session()
+        session = self.current_session()
+        owner = session is None
+        if owner:
+            session = self.begin_session()
         try:
             result = f(self, session, *args, **kwargs)
+            if isinstance(result, Query):
+                result = result.all()
             return result
         except IntegrityError:
             session.rollback()
             raise Exception("Error")
         finally:
-            session.expunge_all()
-            session.close()    
+            if owner:
+                self.end_session()
+    return wrapper
+
+
+def handle_write(f):
+    """ Run a Controller write on the writer thread when the write queue is enabled. 
+        The caller waits for the result, so the call stays synchronous. """
+
+    @wraps(f)
+    def wrapper(self, *args, **kwargs):
+        if self.write_queue is None or self.write_queue.is_writer_thread():
+            return f(self, *args, **kwargs)
+        return self.write_queue.submit(f, self, *args, **kwargs).result()
     return wrapper
 
 
@@ -29,4 +50,15 @@ def handle_login(f):
         if session.get("username") is None:
             return redirect("/get-started")
         return f(*args, **kwargs)
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+
+def handle_api_login(f):
+    """ Handle user login for the JSON API, answering 401 instead of redirecting """
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if session.get("username") is None:
+            return jsonify(error="Not logged in"), 401
+        return f(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,136 @@
+import json
+import queue
+from threading import Lock
+
+
+def notify(session, event, data, *user_ids):
+    """ Queue an event for users, published once the transaction of the session commits """
+
+    session.info.setdefault("events", []).append((event, data, {int(user_id) for user_id in user_ids}))
+
+
+class Subscription(object):
+    """ Events of one user for one stream, in a bounded queue.
+        When the queue is full new events are dropped and the stream is
+        told to resync instead, so a slow client can't hold memory. """
+
+    def __init__(self, user_id, max_queued):
+        self.user_id = user_id
+        self.queue = queue.Queue(max_queued)
+        self.lost = False
+        self.closed = False
+
+    def put(self, event, data):
+        """ Queue an event, returns False if it was dropped """
+
+        try:
+            self.queue.put_nowait((event, data))
+            return True
+        except queue.Full:
+            self.lost = True
+            return False
+
+    def get(self, timeout):
+        """ Next (event, data), ("resync", {}) after lost events, or None after timeout seconds 
+            or once the subscription is closed """
+
+        if self.lost:
+            self.lost = False
+            self.drain()
+            return "resync", {}
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        """ End the stream, waking up a get in progress """
+
+        self.closed = True
+        self.drain()
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def drain(self):
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+
+class EventHub(object):
+    """ EventHub is an in-process publish/subscribe hub. Controller writes
+        queue events on their session with notify; they are published to
+        the subscriptions of the affected users after the commit, and
+        dropped on rollback. At most max_subscribers streams are open at
+        once, as every stream holds a server thread. A user has at most
+        max_per_user of them: a new stream closes the user's oldest one,
+        e.g. the stream of a page the browser already left. """
+
+    def __init__(self, max_subscribers=8, max_queued=100, max_per_user=2):
+        self.lock = Lock()
+        self.max_subscribers = max_subscribers
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.users = {}
+        self.count = 0
+        self.published = 0
+        self.dropped = 0
+        self.evicted = 0
+
+    def subscribe(self, user_id):
+        """ Return a new Subscription of a user, or None when max_subscribers are open """
+
+        with self.lock:
+            subscriptions = self.users.get(int(user_id), [])
+            while subscriptions and len(subscriptions) >= self.max_per_user:
+                subscriptions.pop(0).close()
+                self.count -= 1
+                self.evicted += 1
+            if self.count >= self.max_subscribers:
+                return None
+            subscription = Subscription(int(user_id), self.max_queued)
+            self.users.setdefault(subscription.user_id, []).append(subscription)
+            self.count += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.users.get(subscription.user_id)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.remove(subscription)
+            if not subscriptions:
+                del self.users[subscription.user_id]
+            self.count -= 1
+
+    def publish(self, event, data, *user_ids):
+        with self.lock:
+            subscriptions = [subscription for user_id in user_ids for subscription in self.users.get(user_id, ())]
+        queued = sum(subscription.put(event, data) for subscription in subscriptions)
+        with self.lock:
+            self.published += queued
+            self.dropped += len(subscriptions) - queued
+
+    def after_commit(self, session):
+        """ Session listener, publishes the events of the committed transaction """
+
+        for event, data, user_ids in session.info.pop("events", []):
+            self.publish(event, data, *user_ids)
+
+    def after_rollback(self, session):
+        session.info.pop("events", None)
+
+    def stats(self):
+        with self.lock:
+            return {"subscribers": self.count, "published": self.published, "dropped": self.dropped, 
+                    "evicted": self.evicted}
+
+
+def format_event(event, data):
+    """ An event in the text/event-stream format """
+
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,160 @@
+""" Fill a DB with synthetic users, tasks, activity logs, groups, members,
+    requests, assigned tasks and files. The same seed, scale and base date
+    always build the same data, so benchmark runs are comparable.
+    Task dates are spread around the base date, a fixed day by default.
+
+    >> python generate.py --db-url sqlite:///bench.db --users 1000 --tasks 200 """
+
+import os
+import random
+import argparse
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func
+
+import constants
+from core import Controller
+from insert import insert_defaults
+from models import User, Category, Priority, AvailableActivities, Task, ActivityLog, FilesContent, \
+    Group, UserGroup, Request, TaskAssignment
+
+
+# Day the generated data is spread around, fixed so runs on different days build the same data
+BASE_DATE = date(2024, 1, 1)
+
+WORDS = ["buy", "call", "email", "fix", "plan", "review", "write", "clean", "book", "pay", "read", "send",
+         "milk", "report", "car", "dentist", "invoice", "garden", "slides", "budget", "flight", "gift",
+         "meeting", "kitchen", "taxes", "draft", "backup", "laptop", "party", "groceries"]
+
+
+def insert_rows(session, model, rows, batch_size=constants.IMPORT_BATCH_SIZE):
+    """ Insert rows with one executemany per batch """
+
+    for start in range(0, len(rows), batch_size):
+        session.execute(model.__table__.insert(), rows[start:start + batch_size])
+    session.commit()
+    return len(rows)
+
+
+def next_id(session, column):
+    return (session.query(func.max(column)).scalar() or 0) + 1
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def generate(controller, users=100, tasks=100, days=60, updates=0.3, groups=20, group_size=5,
+             requests=50, assignments=200, files=50, file_size=4096, seed=0, base_date=BASE_DATE):
+    """ Add synthetic data at the given scale and return the number of rows added per table.
+        :tasks: tasks per user, dated up to :days: days before or after :base_date:.
+        :updates: share of tasks with an UPDATED activity log besides the ADDED one. """
+
+    rng = random.Random(seed)
+    session = controller.Session()
+    if not session.query(Category).count():
+        insert_defaults(session)
+    categories = [row.category_id for row in session.query(Category)]
+    priorities = [row.priority_id for row in session.query(Priority)]
+    activities = {row.activity_name: row.activity_id for row in session.query(AvailableActivities)}
+    today = base_date
+    now = datetime.combine(base_date, datetime.min.time()) + timedelta(hours=12)
+    counts = {}
+
+    user_id = next_id(session, User.user_id)
+    userIds = list(range(user_id, user_id + users))
+    counts["users"] = insert_rows(session, User,
+        [{"user_id": _user_id, "username": f"user{_user_id}"} for _user_id in userIds])
+
+    taskRows, logRows = [], []
+    task_id = next_id(session, Task.task_id)
+    for _user_id in userIds:
+        for _ in range(tasks):
+            task_date = today + timedelta(days=rng.randint(-days, days))
+            # Most tasks in the past are done
+            status_id = constants.COMPLETED if task_date < today and rng.random() < 0.7 else constants.ONGOING
+            taskRows.append({"task_id": task_id, "task_title": sentence(rng, 3), "task_desc": sentence(rng, 8),
+                             "task_date": task_date, "user_id": _user_id, "category_id": rng.choice(categories),
+                             "status_id": status_id, "priority_id": rng.choice(priorities)})
+            added = now - timedelta(days=rng.randint(0, days), seconds=rng.randint(0, 86400))
+            logRows.append({"user_id": _user_id, "activity_id": activities["added"],
+                            "task_id": task_id, "log_date": added})
+            if rng.random() < updates:
+                logRows.append({"user_id": _user_id, "activity_id": activities["updated"], "task_id": task_id,
+                                "log_date": added + timedelta(seconds=rng.randint(60, 86400))})
+            task_id += 1
+    counts["tasks"] = insert_rows(session, Task, taskRows)
+    counts["activities_log"] = insert_rows(session, ActivityLog, logRows)
+
+    groupRows, memberRows, members = [], [], {}
+    group_id = next_id(session, Group.group_id)
+    for _ in range(groups if userIds else 0):
+        owner = rng.choice(userIds)
+        groupRows.append({"group_id": group_id, "group_name": sentence(rng, 2), "user_id": owner})
+        others = rng.sample(userIds, min(group_size, len(userIds)))
+        members[group_id] = [owner] + [_user_id for _user_id in others if _user_id != owner][:group_size - 1]
+        memberRows += [{"group_id": group_id, "user_id": _user_id} for _user_id in members[group_id]]
+        group_id += 1
+    counts["groups"] = insert_rows(session, Group, groupRows)
+    counts["user_groups"] = insert_rows(session, UserGroup, memberRows)
+
+    requestRows, assignmentRows = [], []
+    for _ in range(requests if members else 0):
+        _group_id = rng.choice(list(members))
+        requestRows.append({"group_id": _group_id, "sender_id": members[_group_id][0],
+                            "receiver_id": rng.choice(userIds)})
+    for _ in range(assignments if members else 0):
+        _group_id = rng.choice(list(members))
+        assignmentRows.append({"task_title": sentence(rng, 3), "task_desc": sentence(rng, 8),
+                               "task_date": today + timedelta(days=rng.randint(-days, days)),
+                               "category_id": rng.choice(categories),
+                               "status_id": rng.choice([constants.ONGOING, constants.COMPLETED]),
+                               "priority_id": rng.choice(priorities), "group_id": _group_id,
+                               "assigner_id": members[_group_id][0],
+                               "assignee_id": rng.choice(members[_group_id])})
+    counts["request"] = insert_rows(session, Request, requestRows)
+    counts["tasks_assignment"] = insert_rows(session, TaskAssignment, assignmentRows)
+
+    fileRows = []
+    for _ in range(files if userIds else 0):
+        file_hash, _file_size = controller.files.put(rng.getrandbits(8 * file_size).to_bytes(file_size, "big"))
+        fileRows.append({"file_name": sentence(rng, 2).replace(" ", "_") + ".pdf", "file_hash": file_hash,
+                         "file_size": _file_size, "user_id": rng.choice(userIds)})
+    counts["files"] = insert_rows(session, FilesContent, fileRows)
+
+    session.close()
+    controller.invalidate_lookups()
+    # Rows were inserted around the Controller, so its counters are recounted
+    controller.rebuild_counters()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a DB with synthetic data")
+    parser.add_argument("--db-url", default=os.environ.get("TODO_DB_URL", constants.DB_URL))
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--tasks", type=int, default=100, help="tasks per user")
+    parser.add_argument("--days", type=int, default=60, help="task dates spread around the base date")
+    parser.add_argument("--updates", type=float, default=0.3, help="share of tasks updated once")
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--group-size", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--assignments", type=int, default=200)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--file-size", type=int, default=4096, help="bytes per file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--base-date", type=date.fromisoformat, default=BASE_DATE, 
+                        help="YYYY-MM-DD the data is generated around, use today's date for live dashboards")
+    args = parser.parse_args()
+
+    controller = Controller(args.db_url, os.environ.get("TODO_FILES_DIR", constants.FILES_DIR))
+    controller.bootstrap()
+    counts = generate(controller, args.users, args.tasks, args.days, args.updates, args.groups,
+                      args.group_size, args.requests, args.assignments, args.files, args.file_size, args.seed, 
+                      args.base_date)
+    for table, count in counts.items():
+        print(f"{table:<20}{count:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,66 @@
+import os
+
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 
+import constants
 from models import Category, Status, Priority, AvailableActivities
 
 
-engine = create_engine("sqlite:///todo.db")
-Session = sessionmaker(autocommit=False, expire_on_commit=False, bind=engine)
-session = Session()
+def insert_defaults(session):
+    """ Insert the pre-defined lookup rows """
+
+    # Insert pre-defined categories
 
+    addDefault = Category(category_name="Default")
+    session.add(addDefault)
 
-""" Insert pre-defined categories """
+    addPersonal = Category(category_name="Personal")
+    session.add(addPersonal)
 
-addDefault = Category(category_name="Default")
-session.add(addDefault)
+    addShopping = Category(category_name="Shopping")
+    session.add(addShopping)
 
-addPersonal = Category(category_name="Personal")
-session.add(addPersonal)
+    addWishlist = Category(category_name="Wishlist")
+    session.add(addWishlist)
 
-addShopping = Category(category_name="Shopping")
-session.add(addShopping)
+    addWork = Category(category_name="Work")
+    session.add(addWork)
 
-addWishlist = Category(category_name="Wishlist")
-session.add(addWishlist)
 
-addWork = Category(category_name="Work")
-session.add(addWork)
+    # Insert pre-defined priorities
 
+    addHigh = Priority(priority_name="High")
+    session.add(addHigh)
 
-""" Insert pre-defined priorities """
+    addMedium = Priority(priority_name="Medium")
+    session.add(addMedium)
 
-addHigh = Priority(priority_name="High")
-session.add(addHigh)
+    addLow = Priority(priority_name="Low")
+    session.add(addLow)
 
-addMedium = Priority(priority_name="Medium")
-session.add(addMedium)
 
-addLow = Priority(priority_name="Low")
-session.add(addLow)
+    # Insert pre-defined status
 
+    addOngoing = Status(status_name="Ongoing")
+    session.add(addOngoing)
 
-""" Insert pre-defined status """
+    addCompleted = Status(status_name="Completed")
+    session.add(addCompleted)
 
-addOngoing = Status(status_name="Ongoing")
-session.add(addOngoing)
 
-addCompleted = Status(status_name="Completed")
-session.add(addCompleted)
+    # Insert pre-defined activities
 
+    addActivity = AvailableActivities(activity_name="added")
+    session.add(addActivity)
 
-""" Insert pre-defined activities """
+    updateActivity = AvailableActivities(activity_name="updated")
+    session.add(updateActivity)
 
-addActivity = AvailableActivities(activity_name="added")
-session.add(addActivity)
+    session.commit()
 
-updateActivity = AvailableActivities(activity_name="updated")
-session.add(updateActivity)
 
-session.commit()
\ No newline at end of file
+if __name__ == "__main__":
+    engine = create_engine(os.environ.get("TODO_DB_URL", constants.DB_URL))
+    Session = sessionmaker(autocommit=False, expire_on_commit=False, bind=engine)
+    insert_defaults(Session())
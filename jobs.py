@@ -0,0 +1,56 @@
+import logging
+from abc import ABC, abstractmethod
+from threading import Thread, Event
+
+
+logger = logging.getLogger(__name__)
+
+
+class BatchJob(ABC):
+    """ BatchJob runs a job on a background thread every interval seconds.
+        The job is done batch_size rows at a time, each batch in its own short
+        transaction with a pause in between, so a large job never holds the
+        write lock in front of interactive requests. Subclasses implement
+        batch, or can't be built, and set their attributes before calling 
+        BatchJob.__init__, which starts the thread. """
+
+    name = "batch-job"
+    message = "Processed %d rows"
+
+    def __init__(self, interval, batch_size, pause):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    @abstractmethod
+    def batch(self):
+        """ Run one batch and return the number of rows it handled """
+
+    def run_batches(self):
+        """ Run batches until one comes back short and return the number of rows handled """
+
+        done = 0
+        while not self.stopped.is_set():
+            batch = self.batch()
+            done += batch
+            if batch < self.batch_size:
+                break
+            self.stopped.wait(self.pause)
+        return done
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                done = self.run_batches()
+                if done:
+                    logger.info(self.message, done)
+            except Exception:
+                logger.exception("Running %s failed", self.name)
+            self.stopped.wait(self.interval)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
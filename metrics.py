@@ -0,0 +1,117 @@
+import time
+import threading
+from bisect import bisect_left
+
+from sqlalchemy import event
+
+import constants
+
+
+class Histogram(object):
+    """ Prometheus style histogram: counts per upper bound, plus sum and count """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """ (le, count) pairs with the count of observations up to each bound """
+
+        total = 0
+        for le, count in zip(self.buckets + [float("inf")], self.counts):
+            total += count
+            yield ("+Inf" if le == float("inf") else repr(le)), total
+
+
+def format_labels(labels):
+    escape = lambda value: str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return ",".join(f'{name}="{escape(value)}"' for name, value in labels)
+
+
+class Metrics(object):
+    """ Metrics collects the latency of every request and the number and
+        time of the SQL queries it ran, labelled by route, method and status,
+        and renders them in the Prometheus text format.
+        Queries run outside a request, e.g. on the writer thread, are
+        counted under the route "background". """
+
+    def __init__(self, latency_buckets=constants.LATENCY_BUCKETS, query_buckets=constants.QUERY_COUNT_BUCKETS):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.latency_buckets = latency_buckets
+        self.query_buckets = query_buckets
+        self.latency = {}
+        self.queries_per_request = {}
+        self.queries = {}
+
+    def instrument(self, engine):
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context.metrics_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.metrics_start
+        current = getattr(self.local, "queries", None)
+        if current is not None:
+            current[0] += 1
+            current[1] += elapsed
+        else:
+            self.add_queries((("route", "background"), ("method", ""), ("status", "")), 1, elapsed)
+
+    def start_request(self):
+        self.local.start = time.perf_counter()
+        self.local.queries = [0, 0.0]
+
+    def end_request(self, route, method, status):
+        """ Record the request started by start_request on this thread """
+
+        start = getattr(self.local, "start", None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        count, seconds = self.local.queries
+        self.local.start = self.local.queries = None
+        labels = (("route", route), ("method", method), ("status", status))
+        with self.lock:
+            self.latency.setdefault(labels, Histogram(self.latency_buckets)).observe(elapsed)
+            self.queries_per_request.setdefault(labels, Histogram(self.query_buckets)).observe(count)
+        self.add_queries(labels, count, seconds)
+
+    def add_queries(self, labels, count, seconds):
+        with self.lock:
+            totals = self.queries.setdefault(labels, [0, 0.0])
+            totals[0] += count
+            totals[1] += seconds
+
+    def render(self, extra=None):
+        """ All metrics in the Prometheus text format.
+            :extra: optional list of (name, type, help, value) added as they are. """
+
+        lines = []
+        with self.lock:
+            for name, _help, histograms in [
+                    ("todo_http_request_duration_seconds", "Request latency", self.latency),
+                    ("todo_db_queries_per_request", "SQL queries run by a request", self.queries_per_request)]:
+                lines += [f"# HELP {name} {_help}", f"# TYPE {name} histogram"]
+                for labels, histogram in sorted(histograms.items()):
+                    for le, count in histogram.cumulative():
+                        lines.append(f"{name}_bucket{{{format_labels(labels + (('le', le),))}}} {count}")
+                    lines.append(f"{name}_sum{{{format_labels(labels)}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{format_labels(labels)}}} {histogram.count}")
+            for name, _help, index in [("todo_db_queries_total", "SQL queries run", 0),
+                                       ("todo_db_query_seconds_total", "Time spent running SQL queries", 1)]:
+                lines += [f"# HELP {name} {_help}", f"# TYPE {name} counter"]
+                for labels, totals in sorted(self.queries.items()):
+                    lines.append(f"{name}{{{format_labels(labels)}}} {totals[index]}")
+        for name, _type, _help, value in extra or []:
+            lines += [f"# HELP {name} {_help}", f"# TYPE {name} {_type}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
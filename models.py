@@ -1,30 +1,96 @@
+import re
 import time
-
-from sqlalchemy import Column, String, Integer, ForeignKey, create_engine, DateTime, Date, or_, LargeBinary, and_
-from sqlalchemy.orm import sessionmaker
+import logging
+import threading
+from collections import Counter
+from datetime import date, timedelta
+
+from sqlalchemy import Column, String, Integer, ForeignKey, create_engine, DateTime, Date, or_, LargeBinary, and_, \
+    Index, inspect, case, func, literal, text, column, Float, tuple_, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker, deferred, undefer
 from sqlalchemy.ext.declarative import declarative_base
 
+import constants
+
 
 Base = declarative_base()
 
+logger = logging.getLogger(__name__)
+
+
+def on_commit(session, f, *args):
+    """ Run f(*args) once the transaction of a session commits, for side effects 
+        outside the DB such as removing a blob. Dropped on rollback. """
+
+    session.info.setdefault("on_commit", []).append((f, args))
+
 
 class SQLBackend(object):
     """ SQLBackend manages creating the engine and session """
 
-    def __init__(self, DB_URL):
+    def __init__(self, DB_URL, profile="default"):
         self.engine = None
+        self.fts_enabled = False
         self.Session = sessionmaker(autocommit=False, expire_on_commit=False)
-        self.setup_engine(DB_URL)
+        event.listen(self.Session, "after_commit", self.run_on_commit)
+        event.listen(self.Session, "after_rollback", self.drop_on_commit)
+        self.local = threading.local()
+        self.setup_engine(DB_URL, profile)
+
+    def run_on_commit(self, session):
+        """ Session listener, runs the callbacks queued with on_commit in order. 
+            The transaction is already committed, so a failing callback is only logged. """
+
+        for f, args in session.info.pop("on_commit", []):
+            try:
+                f(*args)
+            except Exception:
+                logger.exception("After commit callback %s failed", getattr(f, "__name__", f))
+
+    def drop_on_commit(self, session):
+        session.info.pop("on_commit", None)
+
+    def current_session(self):
+        """ Session of the unit of work running in this thread, if any """
+
+        return getattr(self.local, "session", None)
+
+    def begin_session(self):
+        """ Start a unit of work: every Controller call in this thread shares 
+            its session until end_session, e.g. for the length of a request """
+
+        self.local.session = self.Session()
+        return self.local.session
+
+    def end_session(self):
+        """ Close the unit of work, rolling back anything not committed """
+
+        session = self.current_session()
+        self.local.session = None
+        if session is not None:
+            session.expunge_all()
+            session.close()
     
-    def setup_engine(self, DB_URL):
-        """ Return engine if it exist else create it """
+    def setup_engine(self, DB_URL, profile="default"):
+        """ Return engine if it exist else create it. 
+            :profile: name of the SQLITE_PROFILES entry whose pragmas are set on every connection. """
 
         if self.engine:
             return
         self.engine = create_engine(DB_URL, echo=False, pool_recycle=3600, 
                         connect_args={'check_same_thread': False})
+        self.pragmas = constants.SQLITE_PROFILES[profile]
+        if self.pragmas:
+            event.listen(self.engine, "connect", self.set_pragmas)
         self.Session.configure(bind=self.engine)
 
+    def set_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in self.pragmas.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        cursor.close()
+
     def bootstrap(self):
         """ Establish a connection to the engine """
 
@@ -38,8 +104,72 @@ class SQLBackend(object):
         if not connection:
             raise Exception("Couldn't connect to DB Server even after retries!")
         Base.metadata.create_all(self.engine)
+        self.create_columns()
+        self.create_indexes()
+        self.create_search_index()
         connection.close()
 
+    def create_columns(self):
+        """ Add the columns missing on an existing DB. 
+            Only nullable columns without a server default can be added this way. """
+
+        inspector = inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    columnType = column.type.compile(dialect=self.engine.dialect)
+                    self.engine.execute(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {columnType}')
+
+    def create_indexes(self):
+        """ Create the indexes missing on an existing DB. 
+            create_all only creates indexes together with new tables. """
+
+        inspector = inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(bind=self.engine)
+
+
+    def create_search_index(self):
+        """ Create the FTS5 index over tasks and assigned tasks and the triggers keeping it in sync.
+            Tasks are stored under rowid task_id * 2 and assigned tasks under task_id * 2 + 1,
+            so rows are updated and deleted by rowid. Existing rows are indexed on creation. """
+
+        exists = self.engine.execute("SELECT name FROM sqlite_master WHERE name = 'tasks_fts'").first()
+        if exists:
+            self.fts_enabled = True
+            return
+        try:
+            self.engine.execute("CREATE VIRTUAL TABLE tasks_fts USING fts5(task_title, task_desc, "
+                                "user_id UNINDEXED, prefix='2 3')")
+        except OperationalError:
+            # SQLite built without FTS5, search falls back to LIKE
+            self.fts_enabled = False
+            return
+        with self.engine.begin() as connection:
+            for table, offset, user in (("tasks", 0, "user_id"), ("tasks_assignment", 1, "assignee_id")):
+                connection.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                        INSERT INTO tasks_fts(rowid, task_title, task_desc, user_id) 
+                        VALUES (new.task_id * 2 + {offset}, new.task_title, new.task_desc, new.{user});
+                    END""")
+                connection.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF task_title, task_desc, {user} ON {table} BEGIN
+                        UPDATE tasks_fts SET task_title = new.task_title, task_desc = new.task_desc, user_id = new.{user}
+                        WHERE rowid = old.task_id * 2 + {offset};
+                    END""")
+                connection.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                        DELETE FROM tasks_fts WHERE rowid = old.task_id * 2 + {offset};
+                    END""")
+                connection.execute(f"""
+                    INSERT INTO tasks_fts(rowid, task_title, task_desc, user_id)
+                    SELECT task_id * 2 + {offset}, task_title, task_desc, {user} FROM {table}""")
+        self.fts_enabled = True
+
 
 class User(Base):
     """ Represents users """
@@ -90,6 +220,14 @@ class Task(Base):
     category_id = Column(Integer(), ForeignKey("categories.category_id"), nullable=False)
     status_id = Column(Integer(), ForeignKey("status.status_id"), nullable=False)
     priority_id = Column(Integer(), ForeignKey("priorities.priority_id"), nullable=False)
+    # Set when the task is deleted, the purger removes the row later
+    deleted_at = Column(DateTime(), nullable=True)
+    __table_args__ = (
+        Index("ix_tasks_user_status_date", "user_id", "status_id", "task_date"),
+        Index("ix_tasks_user_category", "user_id", "category_id"),
+        Index("ix_tasks_user_priority", "user_id", "priority_id"),
+        Index("ix_tasks_deleted", "deleted_at", sqlite_where=text("deleted_at IS NOT NULL")),
+    )
 
 
 class AvailableActivities(Base):
@@ -111,6 +249,28 @@ class ActivityLog(Base):
     activity_id = Column(Integer(), ForeignKey("available_activities.activity_id"), nullable=False)
     task_id = Column(Integer(), ForeignKey("tasks.task_id"), nullable=False)
     log_date = Column(DateTime(), nullable=False)
+    __table_args__ = (
+        Index("ix_activities_log_user_date", "user_id", "log_date"),
+        Index("ix_activities_log_task", "task_id"),
+        Index("ix_activities_log_date", "log_date"),
+    )
+
+
+class ActivityArchive(Base):
+    """ Represents a compressed segment of archived activity logs of a user in one month """
+
+    __tablename__ = "activities_archive"
+    segment_id = Column(Integer(), primary_key=True, nullable=False, unique=True, 
+                    autoincrement=True)
+    user_id = Column(Integer(), ForeignKey("users.user_id"), nullable=False)
+    month = Column(String(7), nullable=False)
+    first_date = Column(DateTime(), nullable=False)
+    last_date = Column(DateTime(), nullable=False)
+    rows = Column(Integer(), nullable=False)
+    data = deferred(Column(LargeBinary, nullable=False))
+    __table_args__ = (
+        Index("ix_activities_archive_user_month", "user_id", "month"),
+    )
 
 
 class FilesContent(Base):
@@ -119,8 +279,15 @@ class FilesContent(Base):
     __tablename__ = "files"
     file_id = Column(Integer(), primary_key=True, unique=True, autoincrement=True)
     file_name = Column(String(256))
-    file_data = Column(LargeBinary)
+    # Only set on rows created before files moved to the BlobStore
+    file_data = deferred(Column(LargeBinary))
+    file_hash = Column(String(64))
+    file_size = Column(Integer())
     user_id = Column(Integer(), ForeignKey("users.user_id"), nullable=False)
+    __table_args__ = (
+        Index("ix_files_user", "user_id"),
+        Index("ix_files_hash", "file_hash"),
+    )
 
 
 class Group(Base):
@@ -131,6 +298,9 @@ class Group(Base):
                     autoincrement=True)
     group_name = Column(String(256), nullable=False)
     user_id = Column(Integer(), ForeignKey("users.user_id"), nullable=False)
+    __table_args__ = (
+        Index("ix_groups_user", "user_id"),
+    )
 
 
 class UserGroup(Base):
@@ -140,6 +310,10 @@ class UserGroup(Base):
     id = Column(Integer(), primary_key=True)
     group_id = Column(Integer(), ForeignKey("groups.group_id"), nullable=False)
     user_id = Column(Integer(), ForeignKey("users.user_id"), nullable=False)
+    __table_args__ = (
+        Index("ix_user_groups_user_group", "user_id", "group_id"),
+        Index("ix_user_groups_group_user", "group_id", "user_id"),
+    )
 
 
 class Request(Base):
@@ -150,6 +324,9 @@ class Request(Base):
     group_id = Column(Integer(), ForeignKey("groups.group_id"), nullable=False)
     sender_id = Column(Integer(), ForeignKey("users.user_id"), nullable=False)
     receiver_id = Column(Integer(), ForeignKey("users.user_id"), nullable=False)
+    __table_args__ = (
+        Index("ix_request_receiver_group", "receiver_id", "group_id"),
+    )
 
 
 class TaskAssignment(Base):
@@ -167,29 +344,102 @@ class TaskAssignment(Base):
     group_id = Column(Integer(), ForeignKey("groups.group_id"), nullable=False)
     assignee_id = Column(Integer(), ForeignKey("users.user_id"), nullable=False)
     assigner_id = Column(Integer(), ForeignKey("users.user_id"), nullable=False)
+    __table_args__ = (
+        Index("ix_tasks_assignment_assignee_date", "assignee_id", "task_date"),
+        Index("ix_tasks_assignment_assigner_date", "assigner_id", "task_date"),
+    )
+
+
+class TaskCounter(Base):
+    """ Represents the task counts of a user, kept up to date by every task write.
+        Counters are named "tasks", "status:<id>", "category:<id>", "priority:<id>",
+        "due:<date>" for ongoing tasks per date, "overdue" as of the day in "overdue_day",
+        and "assigned:<status id>" / "tracked:<status id>" for assigned tasks. """
+
+    __tablename__ = "task_counters"
+    user_id = Column(Integer(), ForeignKey("users.user_id"), primary_key=True, nullable=False)
+    counter = Column(String(64), primary_key=True, nullable=False)
+    value = Column(Integer(), nullable=False, default=0)
+
+
+COUNTER_UPSERT = text("""
+    INSERT INTO task_counters (user_id, counter, value) VALUES (:user_id, :counter, :value)
+    ON CONFLICT (user_id, counter) DO UPDATE SET value = value + excluded.value""")
+
+OVERDUE_DAY_INSERT = text("""
+    INSERT INTO task_counters (user_id, counter, value) VALUES (:user_id, 'overdue_day', :value)
+    ON CONFLICT (user_id, counter) DO NOTHING""")
+
+# Recount every counter; {tasks}, {assignee} and {assigner} are filled in with the user filter
+COUNTER_REBUILD = [
+    "SELECT user_id, 'tasks', count(*) FROM tasks WHERE {tasks} GROUP BY user_id",
+    "SELECT user_id, 'status:' || status_id, count(*) FROM tasks WHERE {tasks} GROUP BY user_id, status_id",
+    "SELECT user_id, 'category:' || category_id, count(*) FROM tasks WHERE {tasks} GROUP BY user_id, category_id",
+    "SELECT user_id, 'priority:' || priority_id, count(*) FROM tasks WHERE {tasks} GROUP BY user_id, priority_id",
+    "SELECT user_id, 'due:' || task_date, count(*) FROM tasks WHERE {tasks} AND status_id = :ongoing "
+        "GROUP BY user_id, task_date",
+    "SELECT user_id, 'overdue', count(*) FROM tasks WHERE {tasks} AND status_id = :ongoing "
+        "AND task_date < :today GROUP BY user_id",
+    "SELECT DISTINCT user_id, 'overdue_day', :day FROM tasks WHERE {tasks}",
+    "SELECT assignee_id, 'assigned:' || status_id, count(*) FROM tasks_assignment WHERE {assignee} "
+        "GROUP BY assignee_id, status_id",
+    "SELECT assigner_id, 'tracked:' || status_id, count(*) FROM tasks_assignment WHERE {assigner} "
+        "GROUP BY assigner_id, status_id",
+]
 
 
 class Customer:
     """ Represents customer operations. Methods perform SQL statments on DB classes """
 
+    def save(self, session, commit=True):
+        """ Commit, or only flush when the caller commits several writes together. 
+            Sessions of the writer thread are committed once per batch, so they only flush. """
+
+        if commit and not session.info.get("group_commit"):
+            session.commit()
+        else:
+            session.flush()
+
+    def keyset(self, query, columns, after=None, limit=None, descending=False):
+        """ Keyset pagination: order by the columns and seek past the
+            :after: values instead of using OFFSET, so every page costs the same. """
+
+        if after is not None:
+            if descending:
+                query = query.filter(tuple_(*columns) < tuple_(*after))
+            else:
+                query = query.filter(tuple_(*columns) > tuple_(*after))
+        query = query.order_by(*[_column.desc() if descending else _column for _column in columns])
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
     ### METHODS FOR TASKS
     def signup(self, session, username):
         user = User(username=username)
         session.add(user)
-        session.commit()
+        self.save(session)
         return user
     
     def get_user(self, session, username):
         user = session.query(User).filter_by(username=username).first()
         return user
 
-    def add_task(self, session, task_title, task_desc, task_date, user_id, category_id, status_id, priority_id):
+    def add_task(self, session, task_title, task_desc, task_date, user_id, category_id, status_id, priority_id, 
+                commit=True):
         task = Task(task_title=task_title, task_desc=task_desc, task_date=task_date, user_id=user_id,
                  category_id=category_id, status_id=status_id, priority_id=priority_id)
         session.add(task)
-        session.commit()
+        self.save(session, commit)
         return task
 
+    def add_tasks(self, session, tasks):
+        """ Insert many tasks with a single executemany. :tasks: list of column dicts """
+
+        session.execute(Task.__table__.insert(), tasks)
+        self.save(session)
+        return len(tasks)
+
     def get_categories(self, session):
         categories = session.query(Category).all()
         return categories
@@ -202,78 +452,263 @@ class Customer:
         priorities = session.query(Priority).all()
         return priorities
 
-    def get_tasks(self, session, user_id):
+    def get_tasks(self, session, user_id, lookups=None, after=None, limit=None):
+        if lookups is not None:
+            tasks = session.query(Task).filter(Task.user_id == user_id).filter(Task.deleted_at.is_(None))
+            tasks = self.keyset(tasks, [Task.task_id], after, limit)
+            return [(task, lookups.get("categories", task.category_id), 
+                        lookups.get("status", task.status_id), 
+                        lookups.get("priorities", task.priority_id)) for task in tasks]
         tasks = session.query(Task, Category, Status, Priority).\
                     filter(Task.category_id == Category.category_id).\
                     filter(Task.status_id == Status.status_id).\
                     filter(Task.priority_id == Priority.priority_id).\
-                    filter(Task.user_id == user_id)
+                    filter(Task.user_id == user_id).\
+                    filter(Task.deleted_at.is_(None))
+        tasks = self.keyset(tasks, [Task.task_id], after, limit)
         return tasks
 
-    def get_task(self, session, task_id):
+    def get_task(self, session, task_id, lookups=None):
+        if lookups is not None:
+            task = session.query(Task).filter(Task.task_id == task_id).filter(Task.deleted_at.is_(None))
+            return [(_task, lookups.get("categories", _task.category_id), 
+                        lookups.get("status", _task.status_id), 
+                        lookups.get("priorities", _task.priority_id)) for _task in task]
         task = session.query(Task, Category, Status, Priority).\
                 filter(Task.category_id == Category.category_id).\
                 filter(Task.status_id == Status.status_id).\
                 filter(Task.priority_id == Priority.priority_id).\
-                filter(Task.task_id == task_id)
+                filter(Task.task_id == task_id).\
+                filter(Task.deleted_at.is_(None))
         return task
 
-    def update_task(self, session, task_id, task_title, task_desc, task_date, category_id, status_id, priority_id):
-        task = session.query(Task).filter(Task.task_id == task_id).\
+    def get_dashboard(self, session, user_id, today, limits, lookups, counts=None):
+        """ Classify the tasks of a user into the dashboard buckets in SQL.
+            Returns the capped tasks of each bucket and the full count per bucket. 
+            :counts: optional count per bucket, e.g. from the task counters, to skip counting. """
+
+        tomorrow = today + timedelta(days=1)
+        ongoing = Task.status_id == constants.ONGOING
+        buckets = {
+            "overdue": and_(ongoing, Task.task_date < today),
+            "today": and_(ongoing, Task.task_date == today),
+            "tomorrow": and_(ongoing, Task.task_date == tomorrow),
+            "upcoming": and_(ongoing, Task.task_date > tomorrow),
+            "completed": Task.status_id == constants.COMPLETED,
+        }
+        if counts is None:
+            bucket = case([(condition, literal(name)) for name, condition in buckets.items()], else_=None)
+            counts = dict.fromkeys(buckets, 0)
+            for name, count in session.query(bucket, func.count(Task.task_id)).\
+                                    filter(Task.user_id == user_id).\
+                                    filter(Task.deleted_at.is_(None)).\
+                                    group_by(bucket):
+                if name is not None:
+                    counts[name] = count
+
+        dashboard = {"counts": counts}
+        for name, condition in buckets.items():
+            order = Task.task_date.desc() if name == "completed" else Task.task_date
+            tasks = session.query(Task).\
+                        filter(Task.user_id == user_id).\
+                        filter(Task.deleted_at.is_(None)).\
+                        filter(condition).\
+                        order_by(order, Task.task_id).\
+                        limit(limits[name]) if counts[name] else []
+            dashboard[name] = [(task, lookups.get("categories", task.category_id), 
+                                lookups.get("status", task.status_id), 
+                                lookups.get("priorities", task.priority_id)) for task in tasks]
+        return dashboard
+
+    def update_task(self, session, task_id, task_title, task_desc, task_date, category_id, status_id, priority_id, 
+                    commit=True):
+        task = session.query(Task).filter(Task.task_id == task_id).filter(Task.deleted_at.is_(None)).\
                     update({Task.task_title: task_title, Task.task_desc: task_desc,
                             Task.task_date: task_date, Task.category_id: category_id,
                             Task.status_id: status_id, Task.priority_id: priority_id},
                             synchronize_session=False)
-        session.commit()
+        self.save(session, commit)
+        return task
+
+    def get_task_owner(self, session, task_id):
+        """ Id of the user of a task, as a list that is empty if the task doesn't exist """
+
+        owner = session.query(Task.user_id).filter(Task.task_id == task_id).\
+                    filter(Task.deleted_at.is_(None)).all()
+        return [user_id for user_id, in owner]
+
+    def get_task_fields(self, session, task_id):
+        """ Owner, date, category, status and priority of a task, None if it doesn't exist """
+
+        task = session.query(Task.user_id, Task.task_date, Task.category_id, Task.status_id, Task.priority_id).\
+                    filter(Task.task_id == task_id).filter(Task.deleted_at.is_(None)).first()
         return task
 
-    def delete_task(self, session, task_id):
-        task = session.query(Task).filter_by(task_id=task_id).delete()
-        session.commit()
+    def delete_task(self, session, task_id, deleted_at, commit=True):
+        """ Tombstone a task. Reads leave it out and the purger removes it and its logs. """
+
+        task = session.query(Task).filter(Task.task_id == task_id).filter(Task.deleted_at.is_(None)).\
+                    update({Task.deleted_at: deleted_at}, synchronize_session=False)
+        self.save(session, commit)
         return task
 
-    def get_tasks_by_category(self, session, user_id, category_id):
+    def get_tasks_fields(self, session, user_id, task_ids):
+        """ Id, owner, date, category, status and priority of the tasks of a user among :task_ids: """
+
+        tasks = session.query(Task.task_id, Task.user_id, Task.task_date, Task.category_id, Task.status_id, 
+                    Task.priority_id).\
+                    filter(Task.task_id.in_(task_ids)).\
+                    filter(Task.user_id == user_id).\
+                    filter(Task.deleted_at.is_(None))
+        return tasks.all()
+
+    def update_tasks(self, session, task_ids, status_id=None, days=0, commit=True):
+        """ Set the status and/or move the date by :days: of many tasks with one UPDATE """
+
+        values = {}
+        if status_id is not None:
+            values[Task.status_id] = status_id
+        if days:
+            values[Task.task_date] = func.date(Task.task_date, f"{days:+d} days")
+        if not values or not task_ids:
+            return 0
+        tasks = session.query(Task).filter(Task.task_id.in_(task_ids)).filter(Task.deleted_at.is_(None)).\
+                    update(values, synchronize_session=False)
+        self.save(session, commit)
+        return tasks
+
+    def delete_tasks(self, session, task_ids, deleted_at, commit=True):
+        """ Tombstone many tasks with one UPDATE """
+
+        tasks = session.query(Task).filter(Task.task_id.in_(task_ids)).filter(Task.deleted_at.is_(None)).\
+                    update({Task.deleted_at: deleted_at}, synchronize_session=False)
+        self.save(session, commit)
+        return tasks
+
+    def purge_tasks(self, session, limit):
+        """ Remove up to :limit: tombstoned tasks and their activity logs. Returns the number removed. """
+
+        taskIds = [task_id for task_id, in session.query(Task.task_id).\
+                        filter(Task.deleted_at.isnot(None)).limit(limit)]
+        if taskIds:
+            session.query(ActivityLog).filter(ActivityLog.task_id.in_(taskIds)).\
+                delete(synchronize_session=False)
+            session.query(Task).filter(Task.task_id.in_(taskIds)).\
+                delete(synchronize_session=False)
+            self.save(session)
+        return len(taskIds)
+
+    def get_tasks_by_category(self, session, user_id, category_id, after=None, limit=None):
         tasksByCategory = session.query(Task, Category).\
                             filter(Task.category_id == Category.category_id).\
                             filter(Task.category_id == category_id).\
-                            filter(Task.user_id == user_id)
+                            filter(Task.user_id == user_id).\
+                            filter(Task.deleted_at.is_(None))
+        tasksByCategory = self.keyset(tasksByCategory, [Task.task_id], after, limit)
         return tasksByCategory
 
-    def get_tasks_by_status(self, session, user_id, status_id):
+    def get_tasks_by_status(self, session, user_id, status_id, after=None, limit=None):
         tasksByStatus = session.query(Task, Status).\
                             filter(Task.status_id == Status.status_id).\
                             filter(Task.status_id == status_id).\
-                            filter(Task.user_id == user_id)
+                            filter(Task.user_id == user_id).\
+                            filter(Task.deleted_at.is_(None))
+        tasksByStatus = self.keyset(tasksByStatus, [Task.task_id], after, limit)
         return tasksByStatus
 
-    def get_tasks_by_priority(self, session, user_id, priority_id):
+    def get_tasks_by_priority(self, session, user_id, priority_id, after=None, limit=None):
         tasksByPriority = session.query(Task, Priority).\
                             filter(Task.priority_id == Priority.priority_id).\
                             filter(Task.priority_id == priority_id).\
-                            filter(Task.user_id == user_id)
+                            filter(Task.user_id == user_id).\
+                            filter(Task.deleted_at.is_(None))
+        tasksByPriority = self.keyset(tasksByPriority, [Task.task_id], after, limit)
         return tasksByPriority
 
-    def search_by(self, session, user_id, parameter):
-        searchByParameter = session.query(Task).\
-                                filter(Task.user_id == user_id).\
-                                filter(or_(Task.task_title.like(parameter), 
-                                Task.task_desc.like(parameter)))
+    def search_query(self, parameter):
+        """ Turn user input into an FTS5 query matching every word as a prefix """
+
+        return " ".join(f'"{word}"*' for word in re.findall(r"\w+", parameter))
+
+    def search_matches(self, parameter, user_id, offset):
+        """ FTS5 matches of a user ranked with BM25, title weighted above description """
+
+        matches = text("SELECT rowid / 2 AS task_id, bm25(tasks_fts, 10.0, 1.0) AS rank FROM tasks_fts "
+                       "WHERE tasks_fts MATCH :query AND user_id = :user_id AND rowid % 2 = :offset").\
+                    bindparams(query=self.search_query(parameter), user_id=user_id, offset=offset).\
+                    columns(column("task_id", Integer), column("rank", Float)).alias("matches")
+        return matches
+
+    def search_by(self, session, user_id, parameter, fts=True, after=None, limit=None):
+        """ Returns (task, rank) rows, best match first. Pages are keyed on (rank, task_id), 
+            but BM25 ranks depend on the whole index and change with every write, so a 
+            write between two pages can repeat or skip results. Every page also scores 
+            all matches of the user before seeking past the cursor. """
+
+        if not fts:
+            parameter = f"%{parameter}%"
+            rank = literal(0.0)
+            searchByParameter = session.query(Task, rank).\
+                                    filter(Task.user_id == user_id).\
+                                    filter(Task.deleted_at.is_(None)).\
+                                    filter(or_(Task.task_title.like(parameter), 
+                                    Task.task_desc.like(parameter)))
+        elif not self.search_query(parameter):
+            return []
+        else:
+            matches = self.search_matches(parameter, user_id, 0)
+            rank = matches.c.rank
+            searchByParameter = session.query(Task, rank).\
+                                    join(matches, matches.c.task_id == Task.task_id).\
+                                    filter(Task.deleted_at.is_(None))
+        searchByParameter = self.keyset(searchByParameter, [rank, Task.task_id], after, limit)
         return searchByParameter
 
+    def search_assigned_tasks(self, session, user_id, parameter, fts=True, limit=None):
+        if not fts:
+            parameter = f"%{parameter}%"
+            assignedTasks = session.query(TaskAssignment).\
+                                filter(TaskAssignment.assignee_id == user_id).\
+                                filter(or_(TaskAssignment.task_title.like(parameter), 
+                                TaskAssignment.task_desc.like(parameter))).\
+                                order_by(TaskAssignment.task_id).\
+                                limit(limit)
+            return assignedTasks
+        if not self.search_query(parameter):
+            return []
+        matches = self.search_matches(parameter, user_id, 1)
+        assignedTasks = session.query(TaskAssignment).\
+                            join(matches, matches.c.task_id == TaskAssignment.task_id).\
+                            order_by(matches.c.rank, TaskAssignment.task_id).\
+                            limit(limit)
+        return assignedTasks
+
     ### METHODS FOR LOGS
-    def add_activity_log(self, session, user_id, activity_id, task_id, log_date):
+    def add_activity_log(self, session, user_id, activity_id, task_id, log_date, commit=True):
         activity = ActivityLog(user_id=user_id, activity_id=activity_id, 
                         task_id=task_id, log_date=log_date)
         session.add(activity)
-        session.commit()
+        self.save(session, commit)
         return activity
+
+    def add_activity_logs(self, session, activities, commit=True):
+        """ Insert many activity log rows with a single executemany """
+
+        session.execute(ActivityLog.__table__.insert(), activities)
+        self.save(session, commit)
+        return len(activities)
     
-    def get_all_activities(self, session, user_id):
+    def get_all_activities(self, session, user_id, after=None, limit=None):
+        """ Activities of a user, newest first """
+
         activities = session.query(ActivityLog, User, AvailableActivities, Task).\
                         filter(ActivityLog.activity_id == AvailableActivities.activity_id).\
                         filter(ActivityLog.user_id == User.user_id).\
                         filter(ActivityLog.task_id == Task.task_id).\
-                        filter(ActivityLog.user_id == user_id)
+                        filter(ActivityLog.user_id == user_id).\
+                        filter(Task.deleted_at.is_(None))
+        activities = self.keyset(activities, [ActivityLog.log_date, ActivityLog.log_id], 
+                        after, limit, descending=True)
         return activities
 
     def get_available_activities(self, session, activity_id):
@@ -281,21 +716,86 @@ class Customer:
                                 filter_by(activity_id=activity_id).first()
         return availableActivities
 
-    def delete_activity_log(self, session, task_id):
+    def get_all_available_activities(self, session):
+        availableActivities = session.query(AvailableActivities).all()
+        return availableActivities
+
+    def delete_activity_log(self, session, task_id, commit=True):
         activity = session.query(ActivityLog).filter_by(task_id=task_id).delete()
-        session.commit()
+        self.save(session, commit)
         return activity
 
+    def get_old_activities(self, session, before, limit):
+        """ The oldest activity logs of all users logged before :before: """
+
+        activities = session.query(ActivityLog).\
+                        filter(ActivityLog.log_date < before).\
+                        order_by(ActivityLog.log_date, ActivityLog.log_id).\
+                        limit(limit)
+        return activities.all()
+
+    def delete_activities(self, session, log_ids, commit=True):
+        activities = session.query(ActivityLog).filter(ActivityLog.log_id.in_(log_ids)).\
+                        delete(synchronize_session=False)
+        self.save(session, commit)
+        return activities
+
+    ### METHODS FOR ACTIVITY ARCHIVE
+    def get_open_segment(self, session, user_id, month, max_rows):
+        """ Latest archive segment of a user and month that has room for more rows, if any """
+
+        segment = session.query(ActivityArchive).\
+                    filter(ActivityArchive.user_id == user_id).\
+                    filter(ActivityArchive.month == month).\
+                    filter(ActivityArchive.rows <= max_rows).\
+                    order_by(ActivityArchive.segment_id.desc()).first()
+        return segment
+
+    def save_segment(self, session, segment, user_id, month, data, first_date, last_date, rows, commit=True):
+        """ Add a new archive segment, or replace the contents of :segment: if given """
+
+        if segment is None:
+            segment = ActivityArchive(user_id=user_id, month=month)
+            session.add(segment)
+        segment.data = data
+        segment.first_date = first_date
+        segment.last_date = last_date
+        segment.rows = rows
+        self.save(session, commit)
+        return segment
+
+    def get_archive_months(self, session, user_id):
+        """ Months with archived activity logs of a user and their number of logs, newest first """
+
+        months = session.query(ActivityArchive.month, func.sum(ActivityArchive.rows)).\
+                    filter(ActivityArchive.user_id == user_id).\
+                    group_by(ActivityArchive.month).\
+                    order_by(ActivityArchive.month.desc())
+        return months
+
+    def get_archive_segments(self, session, user_id, month):
+        segments = session.query(ActivityArchive).\
+                    filter(ActivityArchive.user_id == user_id).\
+                    filter(ActivityArchive.month == month).\
+                    options(undefer(ActivityArchive.data))
+        return segments
+
+    def get_tasks_by_ids(self, session, task_ids):
+        tasks = session.query(Task).filter(Task.task_id.in_(task_ids)).filter(Task.deleted_at.is_(None))
+        return tasks
+
     ### METHODS FOR FILE
-    def add_file(self, session, file_name, file_data, user_id):
-        _file = FilesContent(file_name=file_name, file_data=file_data, user_id=user_id)
+    def add_file(self, session, file_name, file_hash, file_size, user_id):
+        _file = FilesContent(file_name=file_name, file_hash=file_hash, 
+                    file_size=file_size, user_id=user_id)
         session.add(_file)
-        session.commit()
+        self.save(session)
         return _file
     
-    def get_files(self, session, user_id):
+    def get_files(self, session, user_id, after=None, limit=None):
         _files = session.query(FilesContent).\
                     filter(FilesContent.user_id == user_id)
+        _files = self.keyset(_files, [FilesContent.file_id], after, limit)
         return _files
 
     def download_file(self, session, user_id, file_id):
@@ -303,16 +803,43 @@ class Customer:
                     filter_by(user_id=user_id, file_id=file_id).first()
         return _file
 
-    def delete_file(self, session, file_id):
+    def get_file(self, session, file_id):
+        _file = session.query(FilesContent).filter_by(file_id=file_id).first()
+        return _file
+
+    def count_file_refs(self, session, file_hash):
+        refs = session.query(FilesContent).filter_by(file_hash=file_hash).count()
+        return refs
+
+    def delete_file(self, session, file_id, commit=True):
         _file = session.query(FilesContent).filter_by(file_id=file_id).delete()
-        session.commit()
+        self.save(session, commit)
+        return _file
+
+    def get_files_in_db(self, session, batch_size):
+        """ Ids of files whose body is still stored in the DB """
+
+        fileIds = session.query(FilesContent.file_id).\
+                    filter(FilesContent.file_data.isnot(None)).\
+                    limit(batch_size).all()
+        return [fileId for fileId, in fileIds]
+
+    def move_file_data(self, session, file_id, store):
+        """ Write the body of a file to the BlobStore and clear it in the DB """
+
+        _file = session.query(FilesContent).filter_by(file_id=file_id).first()
+        file_hash, file_size = store.put(_file.file_data)
+        _file.file_hash = file_hash
+        _file.file_size = file_size
+        _file.file_data = None
+        self.save(session)
         return _file
 
     ### METHODS FOR GROUPS
     def create_group(self, session, group_name, user_id):
         group = Group(group_name=group_name, user_id=user_id)
         session.add(group)
-        session.commit()
+        self.save(session)
         return group
 
     def get_all_users(self, session, user_id):
@@ -326,7 +853,7 @@ class Customer:
     def send_request(self, session, group_id, receiver_id, sender_id):
         request = Request(group_id=group_id, receiver_id=receiver_id, sender_id=sender_id)
         session.add(request)
-        session.commit()
+        self.save(session)
         return request
 
     def get_request(self, session, receiver_id):
@@ -340,19 +867,18 @@ class Customer:
         request = session.query(Request).\
                     filter(and_(Request.group_id == group_id, Request.receiver_id == receiver_id)).\
                     delete()
-        session.commit()
+        self.save(session)
         return request
 
     def add_user_in_group(self, session, group_id, user_id):
         userInGroup = UserGroup(group_id=group_id, user_id=user_id)
         session.add(userInGroup)
-        session.commit()
+        self.save(session)
         return userInGroup
 
     def get_groups_of_user(self, session, user_id):
         groupsOfUser = session.query(UserGroup, Group).\
-                        filter(UserGroup.group_id == Group.group_id).\
-                        filter(Group.user_id == User.user_id).\
+                        join(Group, UserGroup.group_id == Group.group_id).\
                         filter(UserGroup.user_id == user_id)
         return groupsOfUser
 
@@ -362,25 +888,74 @@ class Customer:
                         filter(UserGroup.group_id == group_id)
         return usersInGroup
 
+    def get_group_user_ids(self, session, group_id):
+        userIds = session.query(UserGroup.user_id).filter(UserGroup.group_id == group_id).all()
+        return [user_id for user_id, in userIds]
+
+    def get_group_members(self, session, user_id):
+        """ Members of every group a user is in, fetched in a single query.
+            Returns group name -> [(username, group_id, user_id)] """
+
+        groupIds = session.query(UserGroup.group_id).filter(UserGroup.user_id == user_id)
+        members = session.query(Group, User).\
+                    join(UserGroup, UserGroup.group_id == Group.group_id).\
+                    join(User, UserGroup.user_id == User.user_id).\
+                    filter(Group.group_id.in_(groupIds.subquery())).\
+                    order_by(Group.group_id, UserGroup.id)
+        groupMembers = {}
+        for group, user in members:
+            groupMembers.setdefault(group.group_name, []).append((user.username, group.group_id, user.user_id))
+        return groupMembers
+
     def get_group(self, session, group_id):
         group = session.query(Group).filter(Group.group_id == group_id)
         return group
 
     ### METHODS FOR ASSIGNING TASK TO OTHERS
-    def assign_task(self, session, task_title, task_desc, task_date, category_id, status_id, priority_id,  assigner_id, assignee_id, group_id):
+    def assign_task(self, session, task_title, task_desc, task_date, category_id, status_id, priority_id,  assigner_id, assignee_id, group_id, 
+                    commit=True):
         assignedTask = TaskAssignment(task_title=task_title, task_desc=task_desc, 
                         task_date=task_date, category_id=category_id, status_id=status_id,
                         priority_id=priority_id, assigner_id=assigner_id, assignee_id=assignee_id, 
                         group_id=group_id) 
         session.add(assignedTask)
-        session.commit()
+        self.save(session, commit)
         return assignedTask
 
+    def assign_task_to_group(self, session, task_title, task_desc, task_date, category_id, status_id, priority_id, 
+                             assigner_id, group_id, exclude=(), commit=True):
+        """ Assign a task to every member of a group but the :exclude: user ids in one flush. 
+            Every row is inserted on its own to take its id, SQLite doesn't promise the rows 
+            of one INSERT ... SELECT consecutive ids. Returns assignee id -> assigned task id. """
+
+        members = session.query(UserGroup.user_id).\
+                    filter(UserGroup.group_id == group_id).\
+                    distinct().\
+                    order_by(UserGroup.user_id)
+        if exclude:
+            members = members.filter(UserGroup.user_id.notin_(exclude))
+        assignments = [TaskAssignment(task_title=task_title, task_desc=task_desc, task_date=task_date, 
+                            category_id=int(category_id), status_id=int(status_id), priority_id=int(priority_id), 
+                            group_id=int(group_id), assignee_id=user_id, assigner_id=int(assigner_id)) 
+                       for user_id, in members]
+        session.add_all(assignments)
+        self.save(session, commit)
+        return {assignment.assignee_id: assignment.task_id for assignment in assignments}
+
     def get_assignee(self, session, assignee_id):
         assignee = session.query(User).filter(User.user_id == assignee_id)
         return assignee
 
-    def get_assigned_tasks(self, session, user_id):
+    def get_assigned_tasks(self, session, user_id, lookups=None):
+        if lookups is not None:
+            assignedTasks = session.query(TaskAssignment, User, Group).\
+                                filter(TaskAssignment.assigner_id == User.user_id).\
+                                filter(TaskAssignment.group_id == Group.group_id).\
+                                order_by(TaskAssignment.task_date).\
+                                filter(TaskAssignment.assignee_id == user_id)
+            return [(task, lookups.get("categories", task.category_id), 
+                        lookups.get("priorities", task.priority_id), 
+                        lookups.get("status", task.status_id), user, group) for task, user, group in assignedTasks]
         assignedTasks = session.query(TaskAssignment, Category, Priority, Status, User, Group).\
                             filter(TaskAssignment.category_id == Category.category_id).\
                             filter(TaskAssignment.priority_id == Priority.priority_id).\
@@ -391,7 +966,16 @@ class Customer:
                             filter(TaskAssignment.assignee_id == user_id)
         return assignedTasks
     
-    def track_assigned_task(self, session, user_id):
+    def track_assigned_task(self, session, user_id, lookups=None):
+        if lookups is not None:
+            assignedTasks = session.query(TaskAssignment, User, Group).\
+                                filter(TaskAssignment.assignee_id == User.user_id).\
+                                filter(TaskAssignment.group_id == Group.group_id).\
+                                order_by(TaskAssignment.task_date).\
+                                filter(TaskAssignment.assigner_id == user_id)
+            return [(task, lookups.get("categories", task.category_id), 
+                        lookups.get("priorities", task.priority_id), 
+                        lookups.get("status", task.status_id), user, group) for task, user, group in assignedTasks]
         assignedTasks = session.query(TaskAssignment, Category, Priority, Status, User, Group).\
                             filter(TaskAssignment.category_id == Category.category_id).\
                             filter(TaskAssignment.priority_id == Priority.priority_id).\
@@ -403,11 +987,18 @@ class Customer:
                             filter(TaskAssignment.assigner_id == user_id)
         return assignedTasks
 
-    def update_assigned_task(self, session, task_id, status_id):
+    def get_assignment_fields(self, session, task_id):
+        """ Assigner, assignee and status of an assigned task, None if it doesn't exist """
+
+        assignment = session.query(TaskAssignment.assigner_id, TaskAssignment.assignee_id, 
+                        TaskAssignment.status_id).filter(TaskAssignment.task_id == task_id).first()
+        return assignment
+
+    def update_assigned_task(self, session, task_id, status_id, commit=True):
         assignedTasks = session.query(TaskAssignment).filter(TaskAssignment.task_id == task_id).\
                             update({TaskAssignment.status_id: status_id},
                             synchronize_session=False)
-        session.commit()
+        self.save(session, commit)
         return assignedTasks
 
     def get_assigned_task(self, session, task_id):
@@ -416,4 +1007,140 @@ class Customer:
                             filter(TaskAssignment.status_id == Status.status_id).\
                             filter(TaskAssignment.priority_id == Priority.priority_id).\
                             filter(TaskAssignment.task_id == task_id)
-        return assignedTtask
\ No newline at end of file
+        return assignedTtask
+
+    ### METHODS FOR TASK COUNTERS
+    def change_counters(self, session, changes):
+        """ Add to the counters with one executemany. :changes: dict of (user_id, counter) to delta """
+
+        rows = [{"user_id": user_id, "counter": counter, "value": value} 
+                    for (user_id, counter), value in changes.items() if value]
+        if rows:
+            session.execute(COUNTER_UPSERT, rows)
+        return len(rows)
+
+    def count_tasks(self, session, added=(), removed=()):
+        """ Count tasks in or out of the counters of their users. 
+            The overdue counters of the users are rolled forward to today first, 
+            so ongoing tasks due before today are counted as overdue. """
+
+        added, removed = list(added), list(removed)
+        userIds = {int(task.user_id) for task in added + removed}
+        if not userIds:
+            return 0
+        today = date.today()
+        overdueDays = dict(session.query(TaskCounter.user_id, TaskCounter.value).\
+                            filter(TaskCounter.user_id.in_(userIds)).\
+                            filter(TaskCounter.counter == "overdue_day"))
+        for user_id in userIds:
+            if overdueDays.get(user_id, 0) < today.toordinal():
+                self.roll_overdue(session, user_id, today, commit=False)
+                overdueDays[user_id] = today.toordinal()
+        changes = Counter()
+        for tasks, sign in ((added, 1), (removed, -1)):
+            for task in tasks:
+                user_id = int(task.user_id)
+                counters = ["tasks", f"status:{int(task.status_id)}", f"category:{int(task.category_id)}", 
+                            f"priority:{int(task.priority_id)}"]
+                if int(task.status_id) == constants.ONGOING:
+                    counters.append(f"due:{task.task_date.isoformat()}")
+                    if task.task_date.toordinal() < overdueDays.get(user_id, 0):
+                        counters.append("overdue")
+                for counter in counters:
+                    changes[(user_id, counter)] += sign
+        return self.change_counters(session, changes)
+
+    def count_assignments(self, session, added=(), removed=()):
+        """ Count assigned tasks in or out of the counters of their assignee and assigner """
+
+        changes = Counter()
+        for assignments, sign in ((added, 1), (removed, -1)):
+            for assignment in assignments:
+                changes[(int(assignment.assignee_id), f"assigned:{int(assignment.status_id)}")] += sign
+                changes[(int(assignment.assigner_id), f"tracked:{int(assignment.status_id)}")] += sign
+        return self.change_counters(session, changes)
+
+    def get_counters(self, session, user_id, counters):
+        """ Values of the named counters of a user by primary key, missing counters are left out """
+
+        values = session.query(TaskCounter.counter, TaskCounter.value).\
+                    filter(TaskCounter.user_id == user_id).\
+                    filter(TaskCounter.counter.in_(counters))
+        return dict(values.all())
+
+    def get_overdue(self, session, user_id, today, counters=None):
+        """ Ongoing tasks of a user due before today without writing: the "overdue" counter 
+            plus the "due:<date>" counters from "overdue_day" up to today. 
+            :counters: may hold the "overdue" and "overdue_day" counters already read. """
+
+        if counters is None:
+            counters = self.get_counters(session, user_id, ["overdue", "overdue_day"])
+        overdue = counters.get("overdue", 0)
+        day = counters.get("overdue_day")
+        if day is not None and day >= today.toordinal():
+            return overdue
+        return overdue + self.sum_due(session, user_id, day, today)
+
+    def sum_due(self, session, user_id, day, today):
+        """ Ongoing tasks of a user due from the ordinal :day: up to today, from any day if :day: is None """
+
+        start = "due:" + (date.fromordinal(day).isoformat() if day is not None else "")
+        due = session.query(func.sum(TaskCounter.value)).\
+                filter(TaskCounter.user_id == user_id).\
+                filter(TaskCounter.counter >= start).\
+                filter(TaskCounter.counter < f"due:{today.isoformat()}").scalar()
+        return due or 0
+
+    def roll_overdue(self, session, user_id, today, commit=True):
+        """ Move "overdue_day" of a user to today and add the tasks due in between to "overdue", 
+            so reads sum no more than the days since the user's last task write. 
+            The day is moved by an UPDATE guarded on its old value and the tasks are added 
+            with a relative upsert, so concurrent writers never overwrite each other. 
+            Returns True if this call moved the day. """
+
+        day = session.query(TaskCounter.value).\
+                filter(TaskCounter.user_id == user_id).\
+                filter(TaskCounter.counter == "overdue_day").scalar()
+        if day is not None and day >= today.toordinal():
+            return False
+        if day is None:
+            moved = session.execute(OVERDUE_DAY_INSERT, {"user_id": user_id, "value": today.toordinal()}).rowcount
+        else:
+            moved = session.query(TaskCounter).\
+                        filter(TaskCounter.user_id == user_id).\
+                        filter(TaskCounter.counter == "overdue_day").\
+                        filter(TaskCounter.value == day).\
+                        update({TaskCounter.value: today.toordinal()}, synchronize_session=False)
+        if moved:
+            due = self.sum_due(session, user_id, day, today)
+            if due:
+                session.execute(COUNTER_UPSERT, {"user_id": user_id, "counter": "overdue", "value": due})
+        self.save(session, commit)
+        return bool(moved)
+
+    def rebuild_counters(self, session, today, user_id=None):
+        """ Recount the counters of a user, or of all users, from the tasks and assigned tasks tables """
+
+        counters = session.query(TaskCounter)
+        if user_id is not None:
+            counters = counters.filter(TaskCounter.user_id == user_id)
+        counters.delete(synchronize_session=False)
+        userFilter = {"tasks": "deleted_at IS NULL", "assignee": "1", "assigner": "1"}
+        if user_id is not None:
+            userFilter = {"tasks": "user_id = :user_id AND deleted_at IS NULL", "assignee": "assignee_id = :user_id", 
+                          "assigner": "assigner_id = :user_id"}
+        params = {"user_id": user_id, "ongoing": constants.ONGOING, "today": today.isoformat(), 
+                  "day": today.toordinal()}
+        for query in COUNTER_REBUILD:
+            session.execute(text("INSERT INTO task_counters (user_id, counter, value) " + 
+                                 query.format(**userFilter)), params)
+        self.save(session)
+        rebuilt = session.query(func.count()).select_from(TaskCounter)
+        if user_id is not None:
+            rebuilt = rebuilt.filter(TaskCounter.user_id == user_id)
+        return rebuilt.scalar()
+
+    def has_counters(self, session):
+        """ False when there are tasks but no counters, e.g. on a DB made before the counters existed """
+
+        return session.query(TaskCounter.user_id).first() is not None or session.query(Task.task_id).first() is None
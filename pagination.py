@@ -0,0 +1,39 @@
+import json
+import base64
+from collections import namedtuple
+
+
+# A page of results and the cursor of the next page, None on the last page
+Page = namedtuple("Page", ["items", "next_cursor"])
+
+
+def encode_cursor(*values):
+    """ Encode the sort key of the last row of a page as an opaque URL-safe cursor """
+
+    data = json.dumps(values, default=lambda value: value.isoformat(), separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, *types):
+    """ Decode a cursor into a tuple, converting each value with the given types.
+        A missing or malformed cursor returns None, which means the first page. """
+
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(types):
+            return None
+        return tuple(_type(value) for _type, value in zip(types, values))
+    except (ValueError, TypeError):
+        return None
+
+
+def paginate(rows, limit, key):
+    """ Build a Page from up to limit + 1 rows.
+        The extra row only tells that there is a next page. """
+
+    rows = list(rows)
+    if len(rows) > limit:
+        return Page(rows[:limit], encode_cursor(*key(rows[limit - 1])))
+    return Page(rows, None)
@@ -0,0 +1,18 @@
+import constants
+from jobs import BatchJob
+
+
+class TaskPurger(BatchJob):
+    """ TaskPurger removes tombstoned tasks and their activity logs every 
+        interval seconds, batch_size tasks per transaction. """
+
+    name = "task-purger"
+    message = "Purged %d deleted tasks"
+
+    def __init__(self, controller, interval=constants.PURGE_INTERVAL, batch_size=constants.PURGE_BATCH_SIZE, 
+                 pause=constants.PURGE_PAUSE):
+        self.controller = controller
+        super().__init__(interval, batch_size, pause)
+
+    def batch(self):
+        return self.controller.purge_tasks(self.batch_size)
@@ -1,19 +1,159 @@
-from io import BytesIO
-from datetime import timedelta, date, datetime
+import os
+import csv
+import time
+import atexit
+import argparse
+from datetime import date, datetime
 
 import waitress
-from flask import Flask, render_template, request, redirect, session, send_file, flash
+from flask import Flask, render_template, request, redirect, session, send_file, flash, url_for, Response, \
+    jsonify
 
 import constants
 from core import Controller
-from decorator import handle_login
+from decorator import handle_login, handle_api_login
+from storage import FileTooLarge
+from bulk import FORMATS
+from cache import PageCache
+from metrics import Metrics
+from events import format_event
+
+
+def as_dict(row):
+    """ Columns of a model as a dict that can be sent as JSON """
+
+    data = {}
+    for column in row.__table__.columns:
+        value = getattr(row, column.key)
+        data[column.key] = value.isoformat() if isinstance(value, (date, datetime)) else value
+    return data
 
 
 def create_app(fos):
     """ Creates the server app """
 
     app = Flask('Todo App')
-    app.config["SECRET_KEY"] = "SECRET_KEY"
+    app.config["SECRET_KEY"] = constants.SECRET_KEY
+    # Requests over this size are rejected before the body is read
+    app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("TODO_MAX_UPLOAD_SIZE", constants.MAX_UPLOAD_SIZE))
+    # Rendered pages of read-mostly routes, TODO_PAGE_CACHE_SIZE=0 turns it off
+    app.page_cache = PageCache(int(os.environ.get("TODO_PAGE_CACHE_SIZE", constants.PAGE_CACHE_SIZE)), 
+                        int(os.environ.get("TODO_PAGE_CACHE_BYTES", constants.PAGE_CACHE_BYTES)))
+
+    app.metrics = Metrics()
+    app.metrics.instrument(fos.engine)
+
+    @app.before_request
+    def start_timer():
+        app.metrics.start_request()
+
+    @app.after_request
+    def record_request(response):
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        app.metrics.end_request(route, request.method, str(response.status_code))
+        return response
+
+    @app.before_request
+    def begin_session():
+        """ One DB session per request, shared by all Controller calls """
+
+        fos.begin_session()
+
+    @app.teardown_request
+    def end_session(error):
+        fos.end_session()
+
+    @app.context_processor
+    def task_counts():
+        """ Badge counts of the navbar, read from the task counters """
+
+        user_id = session.get("user_id")
+        if user_id is None:
+            return {}
+        return {"task_counts": fos.get_task_counts(user_id)}
+
+    @app.errorhandler(413)
+    def request_too_large(error):
+        return render_template("error.html", message="File is too large!"), 413
+
+    def next_page(page):
+        """ URL of the next page of a keyset paginated list """
+
+        if page.next_cursor is None:
+            return None
+        args = request.args.to_dict()
+        args["after"] = page.next_cursor
+        return url_for(request.endpoint, **request.view_args, **args)
+
+    def cached_page(render):
+        """ Serve the page of the user in session from the page cache 
+            until the user's data changes, otherwise render and store it """
+
+        user_id = session.get("user_id")
+        # Pages with flash messages are rendered for one response only
+        if user_id is None or "_flashes" in session or not app.page_cache.max_entries:
+            return render()
+        # The dashboard buckets depend on the date as well
+        version = f"{fos.get_data_version(user_id)}.{date.today().isoformat()}"
+        page = app.page_cache.get(user_id, request.full_path, version)
+        if page is None:
+            page = render()
+            app.page_cache.put(user_id, request.full_path, version, page)
+        return page
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        """ Request and SQL metrics in the Prometheus text format """
+
+        stats = app.page_cache.stats()
+        text = app.metrics.render([
+            ("todo_page_cache_hits_total", "counter", "Page cache hits", stats["hits"]),
+            ("todo_page_cache_misses_total", "counter", "Page cache misses", stats["misses"]),
+            ("todo_page_cache_evictions_total", "counter", "Page cache evictions", stats["evictions"]),
+            ("todo_page_cache_entries", "gauge", "Pages in the page cache", stats["entries"]),
+            ("todo_page_cache_bytes", "gauge", "Size of the pages in the page cache", stats["bytes"]),
+            ("todo_event_streams", "gauge", "Open event streams", fos.events.stats()["subscribers"]),
+            ("todo_events_published_total", "counter", "Events queued to streams", fos.events.stats()["published"]),
+            ("todo_events_dropped_total", "counter", "Events dropped by full stream queues", 
+                fos.events.stats()["dropped"]),
+            ("todo_event_streams_evicted_total", "counter", "Streams closed by a newer stream of the same user", 
+                fos.events.stats()["evicted"])
+        ])
+        return Response(text, mimetype="text/plain; version=0.0.4")
+
+    @app.route("/events", methods=["GET"])
+    @handle_api_login
+    def events():
+        """ Stream the requests and assigned task changes of the user in session as server-sent events.
+            Every stream holds a server thread, so streams end after SSE_MAX_DURATION and 
+            the browser reconnects; when all SSE_MAX_STREAMS are open it is told to retry later. 
+            A new stream of the user closes their oldest one past SSE_STREAMS_PER_USER. """
+
+        user_id = session.get("user_id")
+
+        def stream():
+            # Subscribed on the first read, so a stream that is never read holds nothing
+            subscription = fos.events.subscribe(user_id)
+            if subscription is None:
+                yield f"retry: {constants.SSE_RETRY_MS * 10}\n\n"
+                return
+            try:
+                yield f"retry: {constants.SSE_RETRY_MS}\n\n"
+                deadline = time.monotonic() + constants.SSE_MAX_DURATION
+                while time.monotonic() < deadline:
+                    message = subscription.get(constants.SSE_KEEPALIVE)
+                    if subscription.closed:
+                        # Replaced by a newer stream of the user
+                        yield f"retry: {constants.SSE_RETRY_MS * 10}\n\n"
+                        return
+                    yield ": keep-alive\n\n" if message is None else format_event(*message)
+            finally:
+                fos.events.unsubscribe(subscription)
+
+        response = Response(stream(), mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
 
     @app.route("/get-started", methods=["GET", "POST"])
     def get_started():
@@ -45,35 +185,31 @@ def create_app(fos):
         """ View all tasks of a user and 
             request sent by other users """
 
-        overdue = []
-        today = []
-        tomorrow = []
-        upcoming = []
-        completed = []
-        tasks = fos.get_tasks(session.get("user_id"))
-        for task, category, status, priority in tasks:
-            if task.task_date < date.today() and task.status_id == constants.ONGOING:
-                overdue.append((task, category, status, priority))
-            elif task.task_date == date.today() and task.status_id == constants.ONGOING:
-                today.append((task, category, status, priority))
-            elif task.task_date == date.today() + timedelta(days=1) and task.status_id == constants.ONGOING:
-                tomorrow.append((task, category, status, priority))
-            elif task.task_date > date.today() and task.status_id == constants.ONGOING:
-                upcoming.append((task, category, status, priority))
-            elif task.status_id == constants.COMPLETED:
-                completed.append((task, category, status, priority))
-
-        requestReceived = fos.get_request(receiver_id=session.get("user_id"))
+        def render():
+            limits = {}
+            for name in constants.DASHBOARD_BUCKETS:
+                limit = request.args.get(name, type=int)
+                if limit:
+                    limits[name] = min(max(limit, 1), constants.DASHBOARD_MAX_LIMIT)
+            dashboard = fos.get_dashboard(session.get("user_id"), limits)
+            # "Show more" keeps the limits of the other buckets in the URL
+            more = {name: url_for("index", **dict(limits, **{name: len(dashboard[name]) + constants.DASHBOARD_LIMIT}))
+                    for name in constants.DASHBOARD_BUCKETS}
 
-        context = {
-            "overdue": overdue,
-            "today": today,
-            "tomorrow": tomorrow,
-            "upcoming": upcoming,
-            "completed": completed,
-            "requests": requestReceived
-        }
-        return render_template("index.html", context=context)
+            requestReceived = fos.get_request(receiver_id=session.get("user_id"))
+
+            context = {
+                "overdue": dashboard["overdue"],
+                "today": dashboard["today"],
+                "tomorrow": dashboard["tomorrow"],
+                "upcoming": dashboard["upcoming"],
+                "completed": dashboard["completed"],
+                "counts": dashboard["counts"],
+                "more": more,
+                "requests": requestReceived
+            }
+            return render_template("index.html", context=context)
+        return cached_page(render)
 
 
     @app.route("/logout", methods=["GET"])
@@ -98,11 +234,8 @@ def create_app(fos):
             priority_id = request.form.get("priority_id")
             if not task_title or not task_desc:
                 return render_template("error.html", message="Please fill in all details!")
-            task = fos.add_task(task_title, task_desc, task_date, user_id,
-                    int(category_id), int(status_id), int(priority_id))
-
-            added_activity = fos.get_available_activities(constants.ADDED)
-            fos.add_activity_log(user_id, added_activity.activity_id, task.task_id, datetime.now())
+            fos.add_task(task_title, task_desc, task_date, user_id,
+                int(category_id), int(status_id), int(priority_id))
             flash("Task added!", "info")
             return redirect("/")
         else:
@@ -130,11 +263,7 @@ def create_app(fos):
                 return render_template("error.html", message="Please fill in all details!")
 
             fos.update_task(task_id, task_title, task_desc, task_date, category_id, 
-                status_id, priority_id)
-
-            added_activity = fos.get_available_activities(constants.UPDATED)
-            fos.add_activity_log(session.get("user_id"), added_activity.activity_id, task_id, datetime.now())
-
+                status_id, priority_id, session.get("user_id"))
             flash("Task updated!", "info")
             return redirect("/")
         else:
@@ -152,17 +281,52 @@ def create_app(fos):
     def delete_task(task_id):
 
         fos.delete_task(task_id)
-        fos.delete_activity_log(task_id)
         flash("Task deleted!", "info")
         return redirect("/")
 
+    def bulk_tasks(action, task_ids, days):
+        """ Run a bulk action on tasks of the user in session. 
+            Returns the number of changed tasks, or None for an unknown action. """
+
+        user_id = session.get("user_id")
+        if action == "complete":
+            return fos.update_tasks(user_id, task_ids, status_id=constants.COMPLETED)
+        if action == "reopen":
+            return fos.update_tasks(user_id, task_ids, status_id=constants.ONGOING)
+        if action == "reschedule":
+            return fos.update_tasks(user_id, task_ids, days=days)
+        if action == "delete":
+            return fos.delete_tasks(user_id, task_ids)
+        return None
+
+    @app.route("/bulk-tasks", methods=["POST"])
+    @handle_login
+    def bulk_tasks_form():
+        """ Complete, reopen, reschedule or delete the tasks selected on the dashboard """
+
+        task_ids = request.form.getlist("task_id", type=int)
+        if not task_ids:
+            flash("Please select tasks!", "info")
+            return redirect("/")
+        if len(task_ids) > constants.BULK_MAX_TASKS:
+            return render_template("error.html", message=f"Select at most {constants.BULK_MAX_TASKS} tasks!"), 400
+        days = request.form.get("days", 0, type=int)
+        if abs(days) > constants.BULK_MAX_DAYS:
+            return render_template("error.html", message=f"Move tasks by at most {constants.BULK_MAX_DAYS} days!"), 400
+        changed = bulk_tasks(request.form.get("action"), task_ids, days)
+        if changed is None:
+            return render_template("error.html", message="Unknown action!"), 400
+        flash(f"{changed} tasks changed!", "info")
+        return redirect("/")
+
     @app.route("/search/c/<int:category_id>", methods=["GET"])
     @handle_login
     def get_task_by_category(category_id):
 
-        resultTaskCategory = fos.get_tasks_by_category(session.get("user_id"), category_id)
+        resultTaskCategory = fos.get_tasks_by_category(session.get("user_id"), category_id, request.args.get("after"))
         context = {
-            "resultTaskCategory": resultTaskCategory
+            "resultTaskCategory": resultTaskCategory.items,
+            "next_page": next_page(resultTaskCategory)
         }
         return render_template("results.html", context=context)
 
@@ -170,9 +334,10 @@ def create_app(fos):
     @handle_login
     def get_task_by_status(status_id):
 
-        resultTaskStatus = fos.get_tasks_by_status(session.get("user_id"), status_id)
+        resultTaskStatus = fos.get_tasks_by_status(session.get("user_id"), status_id, request.args.get("after"))
         context = {
-            "resultTaskStatus": resultTaskStatus
+            "resultTaskStatus": resultTaskStatus.items,
+            "next_page": next_page(resultTaskStatus)
         }
         return render_template("results.html", context=context)
 
@@ -180,9 +345,10 @@ def create_app(fos):
     @handle_login
     def get_task_by_priority(priority_id):
 
-        resultTaskPriority = fos.get_tasks_by_priority(session.get("user_id"), priority_id)
+        resultTaskPriority = fos.get_tasks_by_priority(session.get("user_id"), priority_id, request.args.get("after"))
         context = {
-            "resultTaskPriority": resultTaskPriority
+            "resultTaskPriority": resultTaskPriority.items,
+            "next_page": next_page(resultTaskPriority)
         }
         return render_template("results.html", context=context)
 
@@ -191,22 +357,80 @@ def create_app(fos):
     def search_by():
         """ Search task by title or desc """
 
-        parameter = "%" + request.args.get("parameter") + "%"
-        resultSearchBy = fos.search_by(session.get("user_id"), parameter)
+        parameter = request.args.get("parameter", "")
+        resultSearchBy = fos.search_by(session.get("user_id"), parameter, request.args.get("after"))
         context = {
-            "resultSearchBy": resultSearchBy
+            "resultSearchBy": resultSearchBy.items,
+            "next_page": next_page(resultSearchBy)
         }
+        if not request.args.get("after"):
+            context["resultSearchAssigned"] = fos.search_assigned_tasks(session.get("user_id"), parameter)
         return render_template("results.html", context=context)
 
+    ### FUNCTIONS FOR BULK IMPORT AND EXPORT
+    @app.route("/import-tasks", methods=["GET", "POST"])
+    @handle_login
+    def import_tasks():
+        """ Import tasks from a CSV or JSONL file """
+
+        if request.method == "POST":
+            inputFile = request.files.get("inputFile")
+            if not inputFile:
+                return render_template("error.html", message="Please choose a file!")
+            fmt = request.form.get("format") or ("jsonl" if inputFile.filename.endswith(".jsonl") else "csv")
+            if fmt not in FORMATS:
+                return render_template("error.html", message="Unknown file format!")
+            try:
+                imported, rejected, errors = fos.import_tasks(session.get("user_id"), inputFile.stream, fmt)
+            except (UnicodeDecodeError, csv.Error):
+                return render_template("error.html", message=f"File is not a valid UTF-8 {fmt.upper()} file!"), 400
+            flash(f"Imported {imported} tasks, {rejected} rows rejected", "info")
+            if errors:
+                return render_template("import_tasks.html", context={"errors": errors})
+            return redirect("/")
+        else:
+            return render_template("import_tasks.html", context={})
+
+    @app.route("/export-tasks", methods=["GET"])
+    @handle_login
+    def export_tasks():
+        """ Stream all tasks of a user as CSV or JSONL """
+
+        fmt = request.args.get("format", "csv")
+        if fmt not in FORMATS:
+            return render_template("error.html", message="Unknown file format!")
+        lines = fos.export_tasks(session.get("user_id"), fmt)
+        mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+        return Response(lines, mimetype=mimetype, 
+                    headers={"Content-Disposition": f"attachment; filename=tasks.{fmt}"})
+
     ### FUNCTIONS FOR LOGS (FOR TASKS ONLY)
     @app.route("/allactivity", methods=["GET"])
     @handle_login
     def get_all_activities():
         """ All activities of a user """
 
-        resultActivityLog = fos.get_all_activities(session.get("user_id"))
+        resultActivityLog = fos.get_all_activities(session.get("user_id"), request.args.get("after"))
+        context = {
+            "resultActivityLog": resultActivityLog.items,
+            "next_page": next_page(resultActivityLog),
+            "archiveMonths": fos.get_archive_months(session.get("user_id"))
+        }
+        return render_template("results.html", context=context)
+
+    @app.route("/allactivity/archive/<month>", methods=["GET"])
+    @handle_login
+    def get_archived_activities(month):
+        """ Archived activities of a user in a month (YYYY-MM) """
+
+        try:
+            datetime.strptime(month, "%Y-%m")
+        except ValueError:
+            return render_template("error.html", message="Month must be YYYY-MM!"), 400
         context = {
-            "resultActivityLog": resultActivityLog
+            "resultActivityLog": fos.get_archived_activities(session.get("user_id"), month),
+            "archiveMonths": fos.get_archive_months(session.get("user_id")),
+            "archiveMonth": month
         }
         return render_template("results.html", context=context)
 
@@ -219,7 +443,15 @@ def create_app(fos):
             file_name = request.form.get("file_name")
             file_data = request.files["inputFile"]
             user_id = session.get("user_id")
-            _file = fos.add_file(file_name, file_data.read(), user_id)
+            start = time.perf_counter()
+            try:
+                _file = fos.add_file(file_name, file_data.stream, user_id, 
+                            max_size=app.config["MAX_CONTENT_LENGTH"])
+            except FileTooLarge:
+                return render_template("error.html", message="File is too large!"), 413
+            elapsed = time.perf_counter() - start
+            app.logger.info("Uploaded file %s: %d bytes in %.3fs (%.2f MB/s)", _file.file_id, 
+                _file.file_size, elapsed, _file.file_size / (1024 * 1024) / max(elapsed, 1e-6))
             flash("File added!", "info")
             return redirect("/files")
         else:
@@ -229,9 +461,10 @@ def create_app(fos):
     @handle_login
     def get_files():
 
-        resultFiles = fos.get_files(session.get("user_id"))            
+        resultFiles = fos.get_files(session.get("user_id"), request.args.get("after"))
         context = {
-            "resultFiles": resultFiles
+            "resultFiles": resultFiles.items,
+            "next_page": next_page(resultFiles)
         }
         return render_template("results.html", context=context)
 
@@ -239,8 +472,14 @@ def create_app(fos):
     @handle_login
     def download_file(file_id):
 
-        result = fos.download_file(session.get("user_id"), file_id)            
-        return send_file(BytesIO(result.file_data), attachment_filename=f"{result.file_name}.pdf", as_attachment=False)
+        result = fos.download_file(session.get("user_id"), file_id)
+        if result is None or result.file_hash is None:
+            return render_template("error.html", message="File not found!"), 404
+        # Served from disk: supports Range and conditional requests and
+        # lets waitress use its file wrapper instead of buffering the body
+        return send_file(fos.get_file_path(result.file_hash), mimetype="application/pdf",
+                    download_name=f"{result.file_name}.pdf", as_attachment=False,
+                    conditional=True, etag=result.file_hash)
 
     @app.route("/delete-file/<int:file_id>", methods=["GET"])
     @handle_login
@@ -272,17 +511,8 @@ def create_app(fos):
             :groupsDict: Groups with its users. 
             :assigned_task: Task assigned by other users """
 
-        groups = {}
-        groupsOfUser = fos.get_groups_of_user(session.get("user_id"))
-        for UserGroup, Group in groupsOfUser:
-            groups[Group.group_name] = [(_User.username, _UserGroup.group_id, _User.user_id) for _UserGroup, _User in fos.get_users_in_group(UserGroup.group_id)]
-        context = {
-            "users": fos.get_all_users(session.get("user_id")),
-            "groups_created_by_user": fos.get_groups_created_by_user(session.get("user_id")),
-            "groupsDict": groups,
-            "assigned_task": fos.get_assigned_tasks(session.get("user_id"))
-        }
-        return render_template("groups.html", context=context)
+        return cached_page(lambda: render_template("groups.html", 
+                    context=fos.get_groups_page(session.get("user_id"))))
 
     @app.route("/send-request", methods=["POST"])
     @handle_login
@@ -344,13 +574,59 @@ def create_app(fos):
             }
             return render_template("assign_task.html", context=context)
 
+    def unknown_lookup(values):
+        """ Name of the first of category_id, status_id and priority_id in :values: 
+            that is missing or not in the lookup tables, None if they are all known """
+
+        lookups = fos.get_lookups()
+        for key, table in [("category_id", lookups.categories), ("status_id", lookups.status), 
+                           ("priority_id", lookups.priorities)]:
+            if isinstance(values.get(key), bool) or values.get(key) not in table:
+                return key
+        return None
+
+    @app.route("/assign-task/<int:group_id>", methods=["GET", "POST"])
+    @handle_login
+    def assign_task_to_group(group_id):
+        """ Assign a task to every member of a group but the excluded ones """
+
+        if session.get("user_id") not in fos.get_group_user_ids(group_id):
+            return render_template("error.html", message="You are not a member of this group!"), 403
+        if request.method == "POST":
+            task_title = request.form.get("task_title")
+            task_desc = request.form.get("task_desc")
+            x =  request.form.get("task_date")
+            if not task_title or not task_desc or not x:
+                return render_template("error.html", message="Please fill in all details!")
+            task_date = date(year=int(x[:4]), month=int(x[5:7]), day=int(x[8:10]))
+            values = {key: request.form.get(key, type=int) for key in ["category_id", "status_id", "priority_id"]}
+            key = unknown_lookup(values)
+            if key is not None:
+                return render_template("error.html", message=f"Unknown {key}!"), 400
+            assigned = fos.assign_task_to_group(task_title, task_desc, task_date, 
+                values["category_id"], values["status_id"], values["priority_id"], 
+                session.get("user_id"), group_id, request.form.getlist("exclude", type=int))
+            flash(f"Task assigned to {len(assigned)} members!")
+            return redirect("/groups")
+        else:
+            context = {
+                "group_name": fos.get_group(group_id),
+                "members": fos.get_users_in_group(group_id),
+                "categories": fos.get_categories(),
+                "status": fos.get_status(),
+                "priorities": fos.get_priorities()
+            }
+            return render_template("assign_group_task.html", context=context)
+
     @app.route("/track-assigned-task", methods=["GET"])
     def track_assigned_task():
         
-        context = {
-            "tasks": fos.track_assigned_task(session.get("user_id"))
-        }
-        return render_template("track_task.html", context=context)
+        def render():
+            context = {
+                "tasks": fos.track_assigned_task(session.get("user_id"))
+            }
+            return render_template("track_task.html", context=context)
+        return cached_page(render)
 
     @app.route("/update-assigned-task/<int:task_id>", methods=["GET", "POST"])
     def update_assigned_task(task_id):
@@ -367,17 +643,193 @@ def create_app(fos):
             }
             return render_template("update_assigned_task.html", context=context)
 
+    ### FUNCTIONS FOR JSON API
+    def conditional_json(build):
+        """ JSON response of the data of the user in session, tagged with the user's data version. 
+            A client sending the current ETag in If-None-Match gets a 304 without any query. """
+
+        user_id = session.get("user_id")
+        etag = f"{user_id}-{fos.get_data_version(user_id)}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify(build(user_id))
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    def api_limit():
+        limit = request.args.get("limit", constants.PAGE_SIZE, type=int)
+        return min(max(limit, 1), constants.API_MAX_LIMIT)
+
+    def task_dict(task, category, status, priority):
+        data = as_dict(task)
+        data.update(category_name=category.category_name, status_name=status.status_name, 
+                    priority_name=priority.priority_name)
+        return data
+
+    def assigned_task_dict(task, category, priority, status, user, group):
+        data = task_dict(task, category, status, priority)
+        data.update(username=user.username, group_name=group.group_name)
+        return data
+
+    @app.route("/api/tasks", methods=["GET"])
+    @handle_api_login
+    def api_tasks():
+        """ A page of tasks of the user, ?after= takes the next_cursor of the previous page """
+
+        def build(user_id):
+            page = fos.get_tasks(user_id, request.args.get("after"), api_limit())
+            return {"tasks": [task_dict(*row) for row in page.items], "next_cursor": page.next_cursor}
+        return conditional_json(build)
+
+    @app.route("/api/tasks/bulk", methods=["POST"])
+    @handle_api_login
+    def api_bulk_tasks():
+        """ Bulk action on tasks: {"action": "complete" | "reopen" | "reschedule" | "delete", 
+            "task_ids": [...], "days": n} """
+
+        data = request.get_json(silent=True) or {}
+        task_ids = data.get("task_ids")
+        if not isinstance(task_ids, list) or \
+                not all(isinstance(task_id, int) and not isinstance(task_id, bool) for task_id in task_ids):
+            return jsonify(error="task_ids must be a list of ids"), 400
+        if len(task_ids) > constants.BULK_MAX_TASKS:
+            return jsonify(error=f"At most {constants.BULK_MAX_TASKS} task_ids"), 400
+        days = data.get("days", 0)
+        if not isinstance(days, int) or isinstance(days, bool):
+            return jsonify(error="days must be a number of days"), 400
+        if abs(days) > constants.BULK_MAX_DAYS:
+            return jsonify(error=f"days must be at most {constants.BULK_MAX_DAYS}"), 400
+        changed = bulk_tasks(data.get("action"), task_ids, days) if task_ids else 0
+        if changed is None:
+            return jsonify(error="Unknown action"), 400
+        return jsonify(changed=changed)
+
+    @app.route("/api/assigned-tasks", methods=["GET"])
+    @handle_api_login
+    def api_assigned_tasks():
+        """ :assigned_to_me: tasks assigned to the user, with the assigner as username. 
+            :assigned_by_me: tasks the user assigned, with the assignee as username. """
+
+        def build(user_id):
+            return {
+                "assigned_to_me": [assigned_task_dict(*row) for row in fos.get_assigned_tasks(user_id)],
+                "assigned_by_me": [assigned_task_dict(*row) for row in fos.track_assigned_task(user_id)]
+            }
+        return conditional_json(build)
+
+    @app.route("/api/groups", methods=["GET"])
+    @handle_api_login
+    def api_groups():
+        """ :groups_created_by_user: groups created by the user. 
+            :groups: members of every group the user is in. """
+
+        def build(user_id):
+            return {
+                "groups_created_by_user": [as_dict(group) for group in fos.get_groups_created_by_user(user_id)],
+                "groups": {groupName: [{"username": username, "group_id": group_id, "user_id": member_id} 
+                                        for username, group_id, member_id in members] 
+                            for groupName, members in fos.get_group_members(user_id).items()}
+            }
+        return conditional_json(build)
+
+    @app.route("/api/groups/<int:group_id>/assign", methods=["POST"])
+    @handle_api_login
+    def api_assign_task_to_group(group_id):
+        """ Assign a task to every member of a group: {"task_title", "task_desc", "task_date", 
+            "category_id", "status_id", "priority_id", "exclude": [user ids]}. 
+            :exclude: defaults to the assigner. Returns the assigned task id of every assignee. """
+
+        if session.get("user_id") not in fos.get_group_user_ids(group_id):
+            return jsonify(error="Not a member of this group"), 403
+        data = request.get_json(silent=True) or {}
+        try:
+            task_date = date.fromisoformat(str(data.get("task_date")))
+        except ValueError:
+            return jsonify(error="task_date must be YYYY-MM-DD"), 400
+        exclude = data.get("exclude", [session.get("user_id")])
+        if not data.get("task_title") or not data.get("task_desc"):
+            return jsonify(error="task_title and task_desc are required"), 400
+        if not isinstance(exclude, list) or \
+                not all(isinstance(user_id, int) and not isinstance(user_id, bool) for user_id in exclude):
+            return jsonify(error="exclude must be a list of user ids"), 400
+        key = unknown_lookup(data)
+        if key is not None:
+            return jsonify(error=f"Unknown {key}"), 400
+        assigned = fos.assign_task_to_group(data["task_title"], data["task_desc"], task_date, 
+                        data["category_id"], data["status_id"], data["priority_id"], 
+                        session.get("user_id"), group_id, exclude)
+        return jsonify(assigned={str(assignee_id): task_id for assignee_id, task_id in assigned.items()})
+
+    @app.route("/api/requests", methods=["GET"])
+    @handle_api_login
+    def api_requests():
+        """ Requests to join a group received by the user """
+
+        def build(user_id):
+            return {"requests": [{"group_id": group.group_id, "group_name": group.group_name, 
+                                  "sender_id": user.user_id, "sender_name": user.username} 
+                                 for _request, group, user in fos.get_request(user_id)]}
+        return conditional_json(build)
+
+    @app.route("/api/activity", methods=["GET"])
+    @handle_api_login
+    def api_activity():
+        """ A page of the activities of the user, newest first """
+
+        def build(user_id):
+            page = fos.get_all_activities(user_id, request.args.get("after"), api_limit())
+            return {"activities": [{"log_id": log.log_id, "log_date": log.log_date.isoformat(), 
+                                    "activity_name": activity.activity_name, 
+                                    "task_id": task.task_id, "task_title": task.task_title} 
+                                   for log, user, activity, task in page.items],
+                    "next_cursor": page.next_cursor}
+        return conditional_json(build)
+
     return app
 
 
 def main():
     """ Run the server """
 
-    DB_URL = "sqlite:///todo.db"
-    controller = Controller(DB_URL)
+    parser = argparse.ArgumentParser(description="Todo App server")
+    parser.add_argument("--db-url", default=os.environ.get("TODO_DB_URL", constants.DB_URL))
+    parser.add_argument("--db-profile", default=os.environ.get("TODO_DB_PROFILE", constants.DB_PROFILE),
+                        choices=constants.SQLITE_PROFILES)
+    parser.add_argument("--slow-query-ms", type=float, 
+                        default=float(os.environ.get("TODO_SLOW_QUERY_MS", constants.SLOW_QUERY_MS)),
+                        help="log queries slower than this with their query plan, 0 turns it off")
+    parser.add_argument("--activity-retention-days", type=int, 
+                        default=int(os.environ.get("TODO_ACTIVITY_RETENTION_DAYS", constants.ACTIVITY_RETENTION_DAYS)),
+                        help="archive activity logs older than this in the background, 0 turns it off")
+    parser.add_argument("--purge-interval", type=float, 
+                        default=float(os.environ.get("TODO_PURGE_INTERVAL", constants.PURGE_INTERVAL)),
+                        help="seconds between purges of deleted tasks, 0 turns it off")
+    parser.add_argument("--threads", type=int, 
+                        default=int(os.environ.get("TODO_SERVER_THREADS", constants.SERVER_THREADS)),
+                        help="server threads, event streams take up to SSE_MAX_STREAMS of them")
+    args = parser.parse_args()
+
+    controller = Controller(args.db_url, os.environ.get("TODO_FILES_DIR", constants.FILES_DIR), 
+                    args.db_profile)
     controller.bootstrap()
+    controller.migrate_files()
+    if args.slow_query_ms:
+        controller.enable_slow_query_log(args.slow_query_ms)
+    if os.environ.get("TODO_LOG_WRITE_BEHIND"):
+        controller.enable_log_buffer()
+    if os.environ.get("TODO_WRITE_QUEUE"):
+        controller.enable_write_queue()
+    if args.activity_retention_days:
+        controller.enable_archiver(args.activity_retention_days)
+    if args.purge_interval:
+        controller.enable_purger(args.purge_interval)
+    # Keep at least half of the server threads for normal requests
+    controller.events.max_subscribers = min(constants.SSE_MAX_STREAMS, args.threads // 2)
+    atexit.register(controller.close)
     app = create_app(controller)
-    waitress.serve(app, host='0.0.0.0', port=8080)
+    waitress.serve(app, host='0.0.0.0', port=8080, threads=args.threads)
 
 
 if __name__ == '__main__':
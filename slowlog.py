@@ -0,0 +1,76 @@
+import sys
+import time
+import logging
+import threading
+
+from sqlalchemy import event
+
+from models import SQLBackend, Customer
+
+
+logger = logging.getLogger(__name__)
+
+
+def calling_method():
+    """ Name of the innermost Customer or Controller method on the stack.
+        Queries returned by a Controller method run in its handle_session wrapper. """
+
+    frame = sys._getframe(1)
+    while frame is not None:
+        _self = frame.f_locals.get("self")
+        if isinstance(_self, (Customer, SQLBackend)):
+            name = frame.f_code.co_name
+            if name == "wrapper" and "f" in frame.f_locals:
+                name = frame.f_locals["f"].__name__
+            return f"{type(_self).__name__}.{name}"
+        frame = frame.f_back
+    return None
+
+
+class SlowQueryLog(object):
+    """ SlowQueryLog logs every query slower than threshold seconds with its
+        parameters, duration and the Customer or Controller method that ran it.
+        The first time a statement is slow, its EXPLAIN QUERY PLAN is logged too,
+        so full table scans and temp B-trees show up. """
+
+    def __init__(self, engine, threshold=0.1):
+        self.engine = engine
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.explained = set()
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context.slow_query_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.slow_query_start
+        if elapsed < self.threshold:
+            return
+        logger.warning("Slow query %.1f ms in %s: %s %r", elapsed * 1000, calling_method(),
+                       " ".join(statement.split()), parameters)
+        with self.lock:
+            first = statement not in self.explained
+            self.explained.add(statement)
+        if first and self.engine.dialect.name == "sqlite":
+            plan = self.explain(conn, statement, parameters[0] if executemany else parameters)
+            logger.warning("Query plan of the slow query:\n%s", plan)
+
+    def explain(self, conn, statement, parameters):
+        """ EXPLAIN QUERY PLAN of a statement as an indented tree """
+
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            rows = cursor.fetchall()
+        except Exception as error:
+            return f"not available: {error}"
+        finally:
+            cursor.close()
+        depth = {0: 0}
+        lines = []
+        for _id, parent, _, detail in rows:
+            depth[_id] = depth.get(parent, 0) + 1
+            lines.append("  " * depth[_id] + detail)
+        return "\n".join(lines)
@@ -0,0 +1,95 @@
+import os
+import hashlib
+import tempfile
+from io import BytesIO
+from threading import Lock
+from collections import Counter
+
+
+class FileTooLarge(Exception):
+    """ Raised when a blob is bigger than the allowed size """
+
+
+class BlobStore(object):
+    """ BlobStore keeps file bodies on disk, addressed by their SHA-256.
+        Blobs are stored under <root>/<first 2 hex chars>/<hash>,
+        so identical uploads share one file. A blob can be held by an
+        upload until its file row is saved, so it isn't deleted meanwhile. """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.tmp = os.path.join(self.root, "tmp")
+        os.makedirs(self.tmp, exist_ok=True)
+        self.lock = Lock()
+        self.holds = Counter()
+
+    def path(self, file_hash):
+        """ Return the path of a blob """
+
+        return os.path.join(self.root, file_hash[:2], file_hash)
+
+    def exists(self, file_hash):
+        return os.path.exists(self.path(file_hash))
+
+    def put(self, data):
+        """ Write a blob from bytes and return its hash and size """
+
+        return self.put_stream(BytesIO(data))
+
+    def put_stream(self, stream, chunk_size=64 * 1024, max_size=None, hold=False):
+        """ Write a blob from a file-like object in fixed-size chunks and return its hash and size.
+            The hash and size are computed while copying, and the blob is written to a
+            temp file first and renamed into place, so readers never see a partial file.
+            With hold the blob is kept from deletion until release is called. """
+
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmpPath = tempfile.mkstemp(dir=self.tmp)
+        try:
+            with os.fdopen(fd, "wb") as tmpFile:
+                for chunk in iter(lambda: stream.read(chunk_size), b""):
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise FileTooLarge(f"File is larger than {max_size} bytes")
+                    sha.update(chunk)
+                    tmpFile.write(chunk)
+            file_hash = sha.hexdigest()
+            with self.lock:
+                if self.exists(file_hash):
+                    os.remove(tmpPath)
+                else:
+                    self.commit(tmpPath, file_hash)
+                if hold:
+                    self.holds[file_hash] += 1
+        except BaseException:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
+        return file_hash, size
+
+    def commit(self, tmpPath, file_hash):
+        """ Move a fully written temp file to its content address """
+
+        os.makedirs(os.path.dirname(self.path(file_hash)), exist_ok=True)
+        os.replace(tmpPath, self.path(file_hash))
+
+    def release(self, file_hash):
+        """ Drop a hold taken by put_stream """
+
+        with self.lock:
+            self.holds[file_hash] -= 1
+            if self.holds[file_hash] <= 0:
+                del self.holds[file_hash]
+
+    def delete(self, file_hash, in_use=None):
+        """ Remove a blob unless it is held, or in_use() says a file still references it.
+            Returns True if the blob was removed. """
+
+        with self.lock:
+            if self.holds[file_hash] or (in_use is not None and in_use()):
+                return False
+            try:
+                os.remove(self.path(file_hash))
+            except FileNotFoundError:
+                pass
+            return True
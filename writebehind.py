@@ -0,0 +1,98 @@
+import logging
+from collections import deque
+from threading import Lock, Thread, Event
+
+from sqlalchemy.exc import OperationalError
+
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityLogBuffer(object):
+    """ ActivityLogBuffer holds activity log rows in memory and writes them
+        with one executemany per flush instead of one commit per row.
+        A flush happens when max_rows are buffered or every interval seconds.
+        Buffered rows are lost if the process dies before the next flush. 
+        The rows are written by write(rows), which commits them. If a batch fails, 
+        its rows are written one by one and the rows that still fail are kept 
+        in dead_letters instead of blocking the buffer. """
+
+    def __init__(self, write, max_rows=100, interval=1.0, max_dead_letters=1000):
+        self.write = write
+        self.max_rows = max_rows
+        self.interval = interval
+        self.dead_letters = deque(maxlen=max_dead_letters)
+        self.lock = Lock()
+        self.flush_lock = Lock()
+        self.rows = []
+        self.stopped = Event()
+        self.wake = Event()
+        self.thread = Thread(target=self.run, name="activity-log-flusher", daemon=True)
+        self.thread.start()
+
+    def add(self, user_id, activity_id, task_id, log_date):
+        with self.lock:
+            self.rows.append({"user_id": user_id, "activity_id": activity_id,
+                              "task_id": task_id, "log_date": log_date})
+            full = len(self.rows) >= self.max_rows
+        if full:
+            # Flushed by the background thread, the caller may still hold a write lock
+            self.wake.set()
+
+    def discard(self, *task_ids):
+        """ Drop the buffered rows of tasks, used once the tasks are deleted.
+            Rows of a flush in progress are still written, the tombstoned 
+            tasks are only purged later. """
+
+        task_ids = set(task_ids)
+        with self.lock:
+            self.rows = [row for row in self.rows if row["task_id"] not in task_ids]
+
+    def flush(self):
+        """ Write all buffered rows in one transaction and return how many were written """
+
+        with self.flush_lock:
+            with self.lock:
+                rows, self.rows = self.rows, []
+            if not rows:
+                return 0
+            try:
+                return self.write(rows)
+            except OperationalError:
+                # The DB is busy or unavailable, keep the rows for the next flush
+                self.requeue(rows)
+                raise
+            except Exception:
+                logger.exception("Writing %d activity logs failed, retrying them one by one", len(rows))
+            written = 0
+            for i, row in enumerate(rows):
+                try:
+                    written += self.write([row])
+                except OperationalError:
+                    self.requeue(rows[i:])
+                    raise
+                except Exception:
+                    logger.exception("Dropping activity log %r", row)
+                    self.dead_letters.append(row)
+            return written
+
+    def requeue(self, rows):
+        with self.lock:
+            self.rows = rows + self.rows
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing activity logs failed")
+
+    def close(self):
+        """ Stop the background flusher and write what is left """
+
+        self.stopped.set()
+        self.wake.set()
+        self.thread.join()
+        self.flush()
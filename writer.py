@@ -0,0 +1,79 @@
+import time
+from queue import Queue, Empty
+from concurrent.futures import Future
+from threading import Thread, current_thread
+
+
+class WriteQueue(object):
+    """ WriteQueue runs the Controller writes on a single writer thread.
+        Writes waiting in the queue are run in one session and committed once
+        (group commit), so concurrent requests don't fight over the SQLite
+        write lock and share one fsync. If a batch fails, its writes are
+        retried one by one so only the failing write gets the error. """
+
+    def __init__(self, backend, max_batch=64, max_delay=0.0):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = Queue()
+        self.thread = Thread(target=self.run, name="db-writer", daemon=True)
+        self.thread.start()
+
+    def is_writer_thread(self):
+        return current_thread() is self.thread
+
+    def submit(self, f, *args, **kwargs):
+        """ Queue a write and return a Future of its result """
+
+        future = Future()
+        self.queue.put((future, f, args, kwargs))
+        return future
+
+    def next_batch(self):
+        """ Block for one write, then take what else is queued,
+            waiting up to max_delay seconds for more """
+
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch and batch[-1] is not None:
+            try:
+                batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            writes = [write for write in batch if write is not None and write[0].set_running_or_notify_cancel()]
+            if writes:
+                self.commit(writes)
+            if batch[-1] is None:
+                return
+
+    def commit(self, writes):
+        session = self.backend.begin_session()
+        session.info["group_commit"] = True
+        try:
+            results = [f(*args, **kwargs) for future, f, args, kwargs in writes]
+            session.commit()
+        except Exception as error:
+            session.rollback()
+            results = error
+        finally:
+            self.backend.end_session()
+
+        if not isinstance(results, Exception):
+            for (future, f, args, kwargs), result in zip(writes, results):
+                future.set_result(result)
+        elif len(writes) == 1:
+            writes[0][0].set_exception(results)
+        else:
+            for write in writes:
+                self.commit([write])
+
+    def close(self):
+        """ Run the writes already queued and stop the writer thread """
+
+        self.queue.put(None)
+        self.thread.join()